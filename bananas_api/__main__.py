@@ -11,12 +11,33 @@ from openttd_helpers import click_helper
 from openttd_helpers.logging_helper import click_logging
 from openttd_helpers.sentry_helper import click_sentry
 
-from .helpers.content_save import click_content_save
+from .helpers.content_save import (
+    click_content_save,
+    prepare_for_fork,
+    reload_index,
+    set_on_disk_changed,
+    set_read_only,
+)
+from .helpers.loop_watchdog import (
+    click_loop_watchdog,
+    setup_loop_watchdog,
+)
+from .helpers.metrics import setup_metrics
+from .helpers.regions import get_regions
+from .helpers.tracing import click_tracing
 from .helpers.user_session import (
     click_user_session,
     register_webroutes,
     start_check_expire,
 )
+from .helpers.web_routes import click_json_encoder
+from .helpers.workers import (
+    INDEX_CHANGED_SIGNAL,
+    notify_index_changed,
+    run_workers,
+    setup_reader_app,
+    writer_remote_middleware,
+)
 from .new_upload.session import click_cleanup_graceperiod
 from .new_upload.session_publish import click_storage
 from .user.github import click_user_github
@@ -26,9 +47,12 @@ from .web_routes import (
     discover,
     fallback,
     new,
+    profile,
     update,
     user as web_user,
 )
+from .web_routes.discover import click_discover_cache_control
+from .web_routes.profile import click_profile
 from .web_routes.user import click_client_file
 
 log = logging.getLogger(__name__)
@@ -87,6 +111,92 @@ async def _run_tusd(host, tusd_port, web_port, base_path, behind_proxy=False):
     await tusd_proc.wait()
 
 
+def _create_webapp(remote_ip_header):
+    webapp = web.Application()
+    if remote_ip_header:
+        global REMOTE_IP_HEADER
+        REMOTE_IP_HEADER = remote_ip_header.upper()
+        webapp.middlewares.insert(0, remote_ip_header_middleware)
+
+    webapp.add_routes(common.routes)
+    webapp.add_routes(config.routes)
+    webapp.add_routes(discover.routes)
+    webapp.add_routes(new.routes)
+    webapp.add_routes(update.routes)
+    webapp.add_routes(web_user.routes)
+    webapp.add_routes(profile.routes)
+
+    register_webroutes(webapp)
+
+    # Always make sure "fallback" comes last. It has a catch-all rule.
+    webapp.add_routes(fallback.routes)
+
+    # Insert these last, so they measure everything else too.
+    setup_metrics(webapp)
+    setup_loop_watchdog(webapp)
+
+    return webapp
+
+
+def _start_tusd(loop, bind, tusd_port, web_port, behind_proxy):
+    for host in bind:
+        if ":" in host:
+            host = f"[{host}]"
+        loop.create_task(_run_tusd(host, tusd_port, web_port, "/new-package/tus/", behind_proxy))
+
+
+def _get_read_only_handlers():
+    # Handlers that only read the index, and don't depend on anything else
+    # the writer keeps in memory (like user sessions). The changes feed is
+    # left to the writer, as it is the only one that sees every change.
+    handlers = {route.handler for route in discover.routes}
+    handlers -= {discover.package_from_self, discover.package_changes}
+    handlers |= {route.handler for route in config.routes}
+    handlers |= {common.healthz_handler, fallback.fallback}
+    # Metrics are collected from all workers by the reader handling it.
+    handlers |= {common.metrics, common.metrics_process}
+    # Profiling is about the process handling the request.
+    handlers |= {route.handler for route in profile.routes}
+    return handlers
+
+
+def _run_writer(sock, bind, tusd_port, behind_proxy):
+    set_death_signal()
+    set_on_disk_changed(notify_index_changed)
+
+    webapp = _create_webapp(None)
+    webapp.middlewares.insert(0, writer_remote_middleware)
+
+    loop = asyncio.new_event_loop()
+    start_check_expire(loop)
+    _start_tusd(loop, bind, tusd_port, sock.getsockname()[1], behind_proxy)
+
+    # The readers already log every request.
+    web.run_app(webapp, sock=sock, access_log=None, loop=loop, print=None)
+
+
+def _run_reader(writer_port, sock, bind, web_port, remote_ip_header):
+    set_death_signal()
+    set_read_only()
+
+    webapp = _create_webapp(remote_ip_header)
+    setup_reader_app(webapp, writer_port, _get_read_only_handlers())
+
+    loop = asyncio.new_event_loop()
+    loop.add_signal_handler(INDEX_CHANGED_SIGNAL, reload_index)
+
+    web.run_app(
+        webapp,
+        host=bind,
+        port=web_port,
+        reuse_port=True,
+        sock=sock,
+        access_log_class=ErrorOnlyAccessLogger,
+        loop=loop,
+        print=None,
+    )
+
+
 @click_helper.command()
 @click_logging  # Should always be on top, as it initializes the logging
 @click_sentry
@@ -102,14 +212,27 @@ async def _run_tusd(host, tusd_port, web_port, base_path, behind_proxy=False):
 @click.option(
     "--behind-proxy", help="Respect X-Forwarded-* and similar headers which may be set by proxies.", is_flag=True
 )
+@click.option(
+    "--workers",
+    help="Amount of processes serving the index. With more than one, an additional process handles everything "
+    "that is not only reading the index.",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+)
 @common.click_reload_secret
+@click_discover_cache_control
+@click_json_encoder
+@click_loop_watchdog
+@click_profile
+@click_tracing
 @click_cleanup_graceperiod
 @click_storage
 @click_content_save
 @click_client_file
 @click_user_session
 @click_user_github
-def main(bind, web_port, tusd_port, remote_ip_header, behind_proxy):
+def main(bind, web_port, tusd_port, remote_ip_header, behind_proxy, workers):
     """
     Start the BaNaNaS API.
 
@@ -119,32 +242,25 @@ def main(bind, web_port, tusd_port, remote_ip_header, behind_proxy):
     BANANAS_API_RELOAD_SECRET="test" python -m bananas_api
     """
 
-    webapp = web.Application()
-    if remote_ip_header:
-        global REMOTE_IP_HEADER
-        REMOTE_IP_HEADER = remote_ip_header.upper()
-        webapp.middlewares.insert(0, remote_ip_header_middleware)
-
-    webapp.add_routes(common.routes)
-    webapp.add_routes(config.routes)
-    webapp.add_routes(discover.routes)
-    webapp.add_routes(new.routes)
-    webapp.add_routes(update.routes)
-    webapp.add_routes(web_user.routes)
+    if workers > 1:
+        prepare_for_fork()
+        # Load the regions before forking, so every worker shares them
+        # instead of parsing them again.
+        get_regions()
+        run_workers(
+            workers,
+            lambda sock: _run_writer(sock, bind, tusd_port, behind_proxy),
+            lambda writer_port, sock: _run_reader(writer_port, sock, bind, web_port, remote_ip_header),
+        )
+        return
 
-    register_webroutes(webapp)
-
-    # Always make sure "fallback" comes last. It has a catch-all rule.
-    webapp.add_routes(fallback.routes)
+    webapp = _create_webapp(remote_ip_header)
 
     loop = asyncio.new_event_loop()
     start_check_expire(loop)
 
     # Start tusd as part of the application
-    for host in bind:
-        if ":" in host:
-            host = f"[{host}]"
-        loop.create_task(_run_tusd(host, tusd_port, web_port, "/new-package/tus/", behind_proxy))
+    _start_tusd(loop, bind, tusd_port, web_port, behind_proxy)
 
     # Start aiohttp server
     web.run_app(webapp, host=bind, port=web_port, access_log_class=ErrorOnlyAccessLogger, loop=loop)
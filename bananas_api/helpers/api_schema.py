@@ -1,3 +1,5 @@
+import threading
+
 from collections.abc import Mapping
 from marshmallow import (
     fields,
@@ -8,7 +10,10 @@ from marshmallow import (
 )
 from marshmallow.exceptions import ValidationError
 
-from .content_storage import get_indexed_package
+from .content_storage import (
+    get_indexed_package,
+    get_indexed_version_by_md5sum_partial,
+)
 from .enums import (
     Availability,
     Branch,
@@ -23,14 +28,38 @@ from .enums import (
     Status,
     TerrainType,
 )
-from .regions import REGIONS
+from .regions import get_regions
+from .schema_dump import compile_dump
+from .schema_load import compile_load
 
-DEPENDENCY_CHECK = True
+# Whether dependencies are checked is per thread; a reload in the background
+# should not influence validation done by the web handlers.
+_dependency_check = threading.local()
 
 
 def set_dependency_check(state):
-    global DEPENDENCY_CHECK
-    DEPENDENCY_CHECK = state
+    _dependency_check.enabled = state
+
+
+def get_dependency_error(dependency):
+    # Check the unique-id exists
+    if get_indexed_package(dependency["content_type"], dependency["unique_id"]) is None:
+        return (
+            f"Package with unique-id '{dependency['unique_id']}' does not exist for "
+            f"{dependency['content_type'].value}."
+        )
+
+    # Check there is any version with that md5sum-partial
+    version = get_indexed_version_by_md5sum_partial(
+        dependency["content_type"], dependency["unique_id"], dependency["md5sum_partial"]
+    )
+    if version is None:
+        return (
+            f"No version with md5sum-partial '{dependency['md5sum_partial']}' exist for "
+            f"{dependency['content_type'].value} with unique-id '{dependency['unique_id']}'."
+        )
+
+    return None
 
 
 def _normalize_message(entry):
@@ -81,7 +110,7 @@ class ValidateBytesLength(validate.Length):
 
 class ValidateRegion(validate.Validator):
     def __call__(self, value):
-        if value not in REGIONS.keys():
+        if value not in get_regions():
             raise ValidationError("Invalid region.")
 
         return value
@@ -127,25 +156,12 @@ class Dependency(OrderedSchema):
 
     @validates_schema
     def validate_dependency(self, data, **kwargs):
-        if not DEPENDENCY_CHECK:
+        if not getattr(_dependency_check, "enabled", True):
             return
 
-        # Check the unique-id exists
-        package = get_indexed_package(data["content_type"], data["unique_id"])
-        if package is None:
-            raise ValidationError(
-                f"Package with unique-id '{data['unique_id']}' does not exist for {data['content_type'].value}."
-            )
-
-        # Check there is any version with that md5sum-partial
-        for version in package["versions"]:
-            if version["md5sum_partial"] == data["md5sum_partial"]:
-                break
-        else:
-            raise ValidationError(
-                f"No version with md5sum-partial '{data['md5sum_partial']}' exist for "
-                f"{data['content_type'].value} with unique-id '{data['unique_id']}'."
-            )
+        error = get_dependency_error(data)
+        if error:
+            raise ValidationError(error)
 
 
 class Compatability(OrderedSchema):
@@ -295,3 +311,13 @@ class ConfigRegion(OrderedSchema):
     code = fields.String()
     name = fields.String()
     parent = fields.String()
+
+
+# Precompiled, but otherwise identical, versions of Package().dump() etc.;
+# these are used for everything on the read path.
+dump_package = compile_dump(Package)
+dump_version = compile_dump(Version)
+dump_version_minimized = compile_dump(VersionMinimized)
+# Like Package().load(), but without any validation; only use this for data
+# that is known to be valid.
+load_package_unvalidated = compile_load(Package)
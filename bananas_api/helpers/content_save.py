@@ -1,11 +1,19 @@
 import asyncio
 import click
+import contextvars
 import logging
 import sys
+import threading
 
 from collections import defaultdict
 from openttd_helpers import click_helper
 
+from .content_storage import (
+    start_tracking_changes,
+    swap_local_storage,
+)
+from .tracing import span
+from ..index.common_disk import click_index_common_disk
 from ..index.local import click_index_local
 from ..index.github import click_index_github
 
@@ -17,6 +25,17 @@ _pending_changes = defaultdict(set)
 _pending_package = {}
 _timer = defaultdict(lambda: None)
 _index_instance = None
+# Reloads happen in a background thread; this lock makes sure they never
+# touch the index on disk at the same time as a commit does. Between
+# processes, the lock of the index itself does the same.
+_index_lock = threading.Lock()
+_reload_task = None
+_reload_requested = False
+# Set for processes that only serve the index (see helpers/workers.py); they
+# never write to disk, and reload only what is on disk.
+_read_only = False
+# Called every time this process changed the index on disk.
+_on_disk_changed = None
 
 
 def _store_on_disk_safe(package, display_name):
@@ -26,31 +45,57 @@ def _store_on_disk_safe(package, display_name):
         log.exception("Error while storing data to disk")
 
 
-def store_on_disk(user, package=None):
-    if package:
-        _store_on_disk_safe(package, user.display_name)
+def _store_on_disk_in_thread(packages, display_name):
+    with _index_lock, _index_instance.lock():
+        for package in packages:
+            _store_on_disk_safe(package, display_name)
+
+        with span("push-changes"):
+            _index_instance.push_changes()
+
+
+async def store_on_disk(user, package=None):
+    with span("store-on-disk") as store_span:
+        packages = []
+        if package:
+            packages.append(package)
 
-    while _pending_changes[user.full_id]:
-        content_type, unique_id = _pending_changes[user.full_id].pop()
-        package = _pending_package.get((content_type, unique_id))
+        while _pending_changes[user.full_id]:
+            content_type, unique_id = _pending_changes[user.full_id].pop()
+            package = _pending_package.get((content_type, unique_id))
 
-        # This can happen if 2 authors change a package at the same time. One
-        # of them will cause a commit, so when the other timer expires, the
-        # package is no longer known
-        if package is None:
-            continue
-        del _pending_package[(content_type, unique_id)]
+            # This can happen if 2 authors change a package at the same time. One
+            # of them will cause a commit, so when the other timer expires, the
+            # package is no longer known
+            if package is None:
+                continue
+            del _pending_package[(content_type, unique_id)]
 
-        _store_on_disk_safe(package, user.display_name)
+            packages.append(package)
 
-    _index_instance.push_changes()
+        if packages:
+            store_span.add("packages", len(packages))
+
+        # A reload holds the lock for as long as it takes to fetch and parse
+        # the index; wait for it in a thread, so the event loop never stalls
+        # on it. The context is copied, so the spans end up in this trace.
+        loop = asyncio.get_event_loop()
+        context = contextvars.copy_context()
+        await loop.run_in_executor(None, context.run, _store_on_disk_in_thread, packages, user.display_name)
+
+    if _on_disk_changed:
+        _on_disk_changed()
 
 
 async def _timer_handler(user):
     await asyncio.sleep(TIMER_TIMEOUT)
 
     _timer[user.full_id] = None
-    store_on_disk(user)
+    await store_on_disk(user)
+
+
+def get_pending_changes_count():
+    return len(_pending_package)
 
 
 def queue_store_on_disk(user, package):
@@ -77,6 +122,7 @@ def queue_store_on_disk(user, package):
     required=True,
     callback=click_helper.import_module("bananas_api.index", "Index"),
 )
+@click_index_common_disk
 @click_index_local
 @click_index_github
 @click.option(
@@ -99,5 +145,61 @@ def click_content_save(index, commit_graceperiod, validate):
         sys.exit(0)
 
 
+def set_read_only():
+    global _read_only
+
+    _read_only = True
+
+
+def set_on_disk_changed(callback):
+    global _on_disk_changed
+
+    _on_disk_changed = callback
+
+
+def prepare_for_fork():
+    _index_instance.before_fork()
+
+
+def _reload_index_in_thread():
+    with _index_lock:
+        if _read_only:
+            with _index_instance.lock(shared=True):
+                return _index_instance.reload_from_disk()
+
+        with _index_instance.lock():
+            return _index_instance.reload()
+
+
+async def _reload_index_task():
+    global _reload_task, _reload_requested
+
+    loop = asyncio.get_event_loop()
+
+    # Requests for a reload that come in while reloading are folded into a
+    # single reload after the current one finishes.
+    while _reload_requested:
+        _reload_requested = False
+
+        start_tracking_changes()
+        try:
+            storage = await loop.run_in_executor(None, _reload_index_in_thread)
+        except Exception:
+            log.exception("Failed to reload index; keeping the current index")
+            storage = None
+        swap_local_storage(storage)
+
+        if storage is not None and _on_disk_changed:
+            _on_disk_changed()
+
+    _reload_task = None
+
+
 def reload_index():
-    _index_instance.reload()
+    global _reload_task, _reload_requested
+
+    _reload_requested = True
+
+    if _reload_task is None:
+        loop = asyncio.get_event_loop()
+        _reload_task = loop.create_task(_reload_index_task())
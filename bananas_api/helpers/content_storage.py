@@ -1,89 +1,563 @@
+import bisect
+import heapq
+import re
+import secrets
+import threading
+import time
+
 from collections import defaultdict
+from contextlib import contextmanager
+
+# Weight of a word in the search index, depending on where it is found.
+SEARCH_WEIGHTS = {
+    "name": 8,
+    "tags": 4,
+    "authors": 2,
+    "description": 1,
+}
+_search_token_re = re.compile(r"\w+")
+
+
+def _search_tokens(text):
+    return _search_token_re.findall(text.lower())
 
 
 # A bit hackish, but create a local storage to store information about
 # packages we know. This allows easier wrappers around these variables
 # for other parts of the code to access.
 class LocalStorage:
-    highest_scenario_heightmap_id = 0
-    by_content_type = defaultdict(dict)
-    by_author = defaultdict(lambda: defaultdict(list))
-    by_version = defaultdict(lambda: defaultdict(dict))
-    blacklist = defaultdict(set)
+    def __init__(self):
+        self.highest_scenario_heightmap_id = 0
+        self.by_content_type = defaultdict(dict)
+        self.by_author = defaultdict(lambda: defaultdict(list))
+        self.by_version = defaultdict(lambda: defaultdict(dict))
+        self.blacklist = defaultdict(set)
+        # md5sum-partial is only part of the md5sum, so more than one version
+        # of a package can have the same; per unique-id this is a list.
+        self.by_md5sum_partial = defaultdict(lambda: defaultdict(dict))
+        self.version_names = defaultdict(lambda: defaultdict(set))
+        # Inverted index for searching: per word the packages (as tuple of
+        # content-type and unique-id) with the weight of the word for that
+        # package. The words are also kept sorted, for prefix matching.
+        self.search_index = {}
+        self.search_words = []
+        self.search_by_package = {}
+        # Dependency graph between versions, both ways. A version is a tuple
+        # of content-type, unique-id and md5sum-partial, as that is how
+        # dependencies refer to them. If versions share that tuple, it has
+        # the dependencies of all of them.
+        self.dependencies = {}
+        self.dependents = defaultdict(set)
+
+    def copy(self):
+        # The current storage can be changed by another thread while we are
+        # copying it. So only iterate over snapshots of the containers; the
+        # copy of a single container is atomic.
+        storage = LocalStorage()
+        storage.highest_scenario_heightmap_id = self.highest_scenario_heightmap_id
+
+        for content_type, packages in list(self.by_content_type.items()):
+            storage.by_content_type[content_type] = dict(packages)
+        for key, values in list(self.by_author.items()):
+            for value, packages in list(values.items()):
+                storage.by_author[key][value] = list(packages)
+        for content_type, packages in list(self.by_version.items()):
+            for unique_id, versions in list(packages.items()):
+                storage.by_version[content_type][unique_id] = dict(versions)
+        for content_type, unique_ids in list(self.blacklist.items()):
+            storage.blacklist[content_type] = set(unique_ids)
+        for content_type, md5sum_partials in list(self.by_md5sum_partial.items()):
+            for md5sum_partial, packages in list(md5sum_partials.items()):
+                storage.by_md5sum_partial[content_type][md5sum_partial] = {
+                    unique_id: list(versions) for unique_id, versions in list(packages.items())
+                }
+        for content_type, packages in list(self.version_names.items()):
+            for unique_id, names in list(packages.items()):
+                storage.version_names[content_type][unique_id] = set(names)
+        for word, packages in list(self.search_index.items()):
+            storage.search_index[word] = dict(packages)
+        storage.search_words = list(self.search_words)
+        storage.search_by_package = dict(self.search_by_package)
+        storage.dependencies = dict(self.dependencies)
+        for version_key, dependents in list(self.dependents.items()):
+            storage.dependents[version_key] = set(dependents)
+
+        return storage
+
+    def index_package(self, package, index_versions=True):
+        self.by_content_type[package["content_type"]][package["unique_id"]] = package
+
+        if index_versions:
+            for version in package["versions"]:
+                self.index_version(package["content_type"], package["unique_id"], version)
+        self.index_search(package)
+
+        for author in package["authors"]:
+            for key, value in author.items():
+                if key == "display_name":
+                    continue
+
+                self.by_author[key][value].append(package)
+
+    def unindex_package(self, content_type, unique_id):
+        self.blacklist[content_type].discard(unique_id)
+        self.version_names[content_type].pop(unique_id, None)
+        self.unindex_search(content_type, unique_id)
+
+        for version in self.by_version[content_type].pop(unique_id, {}).values():
+            packages = self.by_md5sum_partial[content_type].get(version["md5sum_partial"], {})
+            packages.pop(unique_id, None)
+            self.unindex_dependencies((content_type, unique_id, version["md5sum_partial"]))
+
+        package = self.by_content_type[content_type].pop(unique_id, None)
+        if package is None:
+            return
+
+        for author in package["authors"]:
+            for key, value in author.items():
+                if key == "display_name":
+                    continue
+
+                packages = self.by_author[key][value]
+                packages[:] = [p for p in packages if p is not package]
+
+    def index_version(self, content_type, unique_id, version):
+        self.by_version[content_type][unique_id][version["upload_date"]] = version
+        versions = self.by_md5sum_partial[content_type][version["md5sum_partial"]].setdefault(unique_id, [])
+        if not any(entry is version for entry in versions):
+            versions.append(version)
+        self.version_names[content_type][unique_id].add(version["version"])
+        self.index_dependencies(content_type, unique_id, version["md5sum_partial"])
+
+    def index_dependencies(self, content_type, unique_id, md5sum_partial):
+        version_key = (content_type, unique_id, md5sum_partial)
+        self.unindex_dependencies(version_key)
+
+        # Without the full md5sum, there is no telling which of the versions
+        # is meant; so depend on what any of them depends on.
+        dependencies = tuple(
+            dict.fromkeys(
+                (dependency["content_type"], dependency["unique_id"], dependency["md5sum_partial"])
+                for version in self.by_md5sum_partial[content_type].get(md5sum_partial, {}).get(unique_id, [])
+                for dependency in version.get("dependencies", [])
+            )
+        )
+        self.dependencies[version_key] = dependencies
+        for dependency in dependencies:
+            self.dependents[dependency].add(version_key)
+
+    def get_version_by_md5sum_partial(self, content_type, unique_id, md5sum_partial):
+        # If more than one version matches, the most recent one is returned.
+        versions = self.by_md5sum_partial[content_type].get(md5sum_partial, {}).get(unique_id)
+        if not versions:
+            return None
+        return max(versions, key=lambda version: version["upload_date"])
+
+    def unindex_dependencies(self, version_key):
+        for dependency in self.dependencies.pop(version_key, ()):
+            dependents = self.dependents.get(dependency)
+            if dependents is None:
+                continue
 
-    def clear(self):
-        # Never reset highest_scenario_heightmap_id
-        self.by_content_type.clear()
-        self.by_author.clear()
-        self.by_version.clear()
-        self.blacklist.clear()
+            dependents.discard(version_key)
+            if not dependents:
+                del self.dependents[dependency]
+
+    def index_version_names(self, package):
+        # Version names can be changed in-place; so rebuild them.
+        self.version_names[package["content_type"]][package["unique_id"]] = {
+            version["version"] for version in package["versions"]
+        }
+
+    def index_search(self, package):
+        # (Re)index the words of a package; both the package itself and every
+        # version can have a name, description and tags.
+        key = (package["content_type"], package["unique_id"])
+        self.unindex_search(*key)
+
+        words = {}
+
+        def add(field, text):
+            for word in _search_tokens(text):
+                words[word] = max(words.get(word, 0), SEARCH_WEIGHTS[field])
+
+        for entry in [package] + package.get("versions", []):
+            add("name", entry.get("name") or "")
+            add("description", entry.get("description") or "")
+            for tag in entry.get("tags") or []:
+                add("tags", tag)
+        for author in package.get("authors", []):
+            add("authors", author.get("display_name") or "")
+
+        for word, weight in words.items():
+            packages = self.search_index.get(word)
+            if packages is None:
+                packages = self.search_index[word] = {}
+                bisect.insort(self.search_words, word)
+            packages[key] = weight
+        self.search_by_package[key] = tuple(words)
+
+    def unindex_search(self, content_type, unique_id):
+        key = (content_type, unique_id)
+
+        for word in self.search_by_package.pop(key, ()):
+            packages = self.search_index[word]
+            packages.pop(key, None)
+            if not packages:
+                del self.search_index[word]
+                del self.search_words[bisect.bisect_left(self.search_words, word)]
+
+    def search(self, query, limit):
+        # Every word in the query has to match (the start of) a word of the
+        # package. A full match counts twice as much as a prefix match.
+        scores = None
+        for query_word in set(_search_tokens(query)):
+            word_scores = {}
+
+            index = bisect.bisect_left(self.search_words, query_word)
+            while index < len(self.search_words) and self.search_words[index].startswith(query_word):
+                word = self.search_words[index]
+                factor = 2 if word == query_word else 1
+                for key, weight in self.search_index[word].items():
+                    if weight * factor > word_scores.get(key, 0):
+                        word_scores[key] = weight * factor
+                index += 1
+
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {key: score + word_scores[key] for key, score in scores.items() if key in word_scores}
+
+            if not scores:
+                return []
+
+        if scores is None:
+            return []
+
+        # Highest score first; on a tie, order on content-type and unique-id to be stable.
+        best = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0][0].value, item[0][1]))
+        return [self.by_content_type[content_type][unique_id] for (content_type, unique_id), _ in best]
 
 
 local_storage = LocalStorage()
 
+# While a new storage is being built (during a reload), the thread building
+# it sees that storage instead of the current one. Everyone else keeps on
+# seeing the current one till the new one is swapped in.
+_building = threading.local()
+# Packages changed in the current storage while a new storage is being
+# built; these are carried over when swapping.
+_changed_during_build = None
+# Increased on every change to the current storage; this allows others to
+# know when to invalidate anything they derived from the storage. It starts
+# at the current time (in milliseconds), so it keeps increasing over
+# restarts.
+_generation = int(time.time() * 1000)
+_last_modified = time.time()
+# Log of (generation, content-type, unique-id) for every change to a
+# package, in order. Only the last CHANGE_LOG_SIZE changes are kept;
+# _change_log_start is the generation before the first change in the log.
+CHANGE_LOG_SIZE = 100000
+_change_log = []
+_change_log_start = _generation
+# The change log only exists in memory, so the sequences handed out for it
+# only mean something to this process. They are "<boot-id>.<generation>";
+# a sequence of an earlier process has another boot-id, so is never mistaken
+# for one of ours (even if the generation is in range).
+_boot_id = secrets.token_hex(8)
+# Per package the generation and time of its last change. Swapping in a new
+# storage counts as a change for every package.
+_package_last_changed = {}
+_swap_last_changed = (0, _last_modified)
+
+
+def _storage():
+    return getattr(_building, "storage", None) or local_storage
+
+
+def _log_change(content_type, unique_id):
+    global _generation, _change_log_start
+
+    _generation += 1
+    _change_log.append((_generation, content_type, unique_id))
+
+    # Trim in bulk, as removing from the front of a list is expensive.
+    if len(_change_log) > CHANGE_LOG_SIZE * 2:
+        _change_log_start = _change_log[-CHANGE_LOG_SIZE - 1][0]
+        del _change_log[:-CHANGE_LOG_SIZE]
+
+
+def _mark_changed(content_type, unique_id):
+    global _last_modified
+
+    # Changes to a storage that is still being built are not visible yet.
+    if getattr(_building, "storage", None) is not None:
+        return
+
+    _log_change(content_type, unique_id)
+    _last_modified = time.time()
+    _package_last_changed[(content_type, unique_id)] = (_generation, _last_modified)
+    if _changed_during_build is not None:
+        _changed_during_build.add((content_type, unique_id))
+
+
+def _log_storage_diff(old_storage, new_storage):
+    # Log every package that is different between the two storages. After
+    # an incremental reload, unchanged packages are the same objects, so
+    # those are cheap to skip.
+    for content_type in set(old_storage.by_content_type) | set(new_storage.by_content_type):
+        old_packages = old_storage.by_content_type.get(content_type, {})
+        new_packages = new_storage.by_content_type.get(content_type, {})
+
+        for unique_id in sorted(old_packages.keys() | new_packages.keys()):
+            old_package = old_packages.get(unique_id)
+            new_package = new_packages.get(unique_id)
+
+            if old_package is not new_package and old_package != new_package:
+                _log_change(content_type, unique_id)
+
+
+@contextmanager
+def build_local_storage(copy_current=False):
+    # Build a new storage, which is only visible for the current thread till
+    # it is swapped in with swap_local_storage(). Either start empty, or with
+    # a copy of the current storage.
+    storage = local_storage.copy() if copy_current else LocalStorage()
+
+    _building.storage = storage
+    try:
+        yield storage
+    finally:
+        _building.storage = None
+
+
+def start_tracking_changes():
+    global _changed_during_build
+    _changed_during_build = set()
+
+
+def swap_local_storage(storage):
+    # Replace the current storage with the newly built storage (or None if
+    # building failed). Packages that were changed in the current storage
+    # after the new storage started building are carried over, as they are
+    # not on disk (yet).
+    global local_storage, _changed_during_build, _generation, _last_modified, _swap_last_changed
+
+    changed = _changed_during_build
+    _changed_during_build = None
+
+    if storage is None:
+        return
+
+    # Never lower highest_scenario_heightmap_id; an unique-id might have
+    # been handed out already.
+    storage.highest_scenario_heightmap_id = max(
+        storage.highest_scenario_heightmap_id, local_storage.highest_scenario_heightmap_id
+    )
+
+    for content_type, unique_id in changed:
+        package = local_storage.by_content_type[content_type].get(unique_id)
+        if package is None:
+            continue
+
+        storage.unindex_package(content_type, unique_id)
+        storage.index_package(package)
+
+    _log_storage_diff(local_storage, storage)
+
+    local_storage = storage
+    _generation += 1
+    _last_modified = time.time()
+    _swap_last_changed = (_generation, _last_modified)
+    _package_last_changed.clear()
+
+
+def get_storage_generation():
+    return _generation
+
+
+def get_storage_last_modified():
+    return _last_modified
+
+
+def get_package_last_changed(content_type, unique_id):
+    # Returns a tuple of the generation and time of the last change.
+    return _package_last_changed.get((content_type, unique_id), _swap_last_changed)
+
+
+def get_changes_sequence(generation=None):
+    # Returns the sequence of the given (or current) generation.
+    return f"{_boot_id}.{_generation if generation is None else generation}"
+
+
+def get_changes_since(boot_id, generation):
+    # Returns a list of (sequence, content-type, unique-id) of every package
+    # changed after the given sequence, ordered by (and with) the sequence
+    # of its last change. Returns None if the sequence is of another process,
+    # or the change log does not go back that far (or the generation is from
+    # the future); the caller has to start over.
+    if boot_id != _boot_id or generation < _change_log_start or generation > _generation:
+        return None
+
+    changes = {}
+    for change in _change_log[bisect.bisect_right(_change_log, generation, key=lambda change: change[0]) :]:
+        key = change[1:]
+        changes.pop(key, None)
+        changes[key] = change
+
+    return [(get_changes_sequence(change[0]), *change[1:]) for change in changes.values()]
+
 
 def add_to_blacklist(content_type, unique_id):
-    local_storage.blacklist[content_type].add(unique_id)
+    _storage().blacklist[content_type].add(unique_id)
 
 
 def is_on_blacklist(content_type, unique_id):
-    return unique_id in local_storage.blacklist[content_type]
+    return unique_id in _storage().blacklist[content_type]
 
 
 def get_highest_scenario_heightmap_id():
-    return local_storage.highest_scenario_heightmap_id
+    return _storage().highest_scenario_heightmap_id
 
 
 def set_if_higher_scenario_heightmap_id(id):
-    if id > local_storage.highest_scenario_heightmap_id:
-        local_storage.highest_scenario_heightmap_id = id
+    storage = _storage()
+    if id > storage.highest_scenario_heightmap_id:
+        storage.highest_scenario_heightmap_id = id
 
 
 def increase_scenario_heightmap_id():
-    local_storage.highest_scenario_heightmap_id += 1
+    _storage().highest_scenario_heightmap_id += 1
 
 
 def index_package(package, index_versions=True):
-    local_storage.by_content_type[package["content_type"]][package["unique_id"]] = package
+    _storage().index_package(package, index_versions=index_versions)
+    _mark_changed(package["content_type"], package["unique_id"])
 
-    if index_versions:
-        for version in package["versions"]:
-            local_storage.by_version[package["content_type"]][package["unique_id"]][version["upload_date"]] = version
 
-    for author in package["authors"]:
-        for key, value in author.items():
-            if key == "display_name":
-                continue
-
-            local_storage.by_author[key][value].append(package)
+def unindex_package(content_type, unique_id):
+    _storage().unindex_package(content_type, unique_id)
 
 
 def index_version(content_type, unique_id, version):
-    local_storage.by_version[content_type][unique_id][version["upload_date"]] = version
+    storage = _storage()
+    storage.index_version(content_type, unique_id, version)
+
+    package = storage.by_content_type[content_type].get(unique_id)
+    if package is not None:
+        storage.index_search(package)
+
+    _mark_changed(content_type, unique_id)
+
+
+def mark_package_changed(package):
+    # Called after a package is modified in-place.
+    storage = _storage()
+    storage.index_version_names(package)
+    storage.index_search(package)
+    for version in package["versions"]:
+        storage.index_dependencies(package["content_type"], package["unique_id"], version["md5sum_partial"])
+    _mark_changed(package["content_type"], package["unique_id"])
 
 
 def get_indexed_count(content_type):
-    return len(local_storage.by_content_type[content_type])
+    return len(_storage().by_content_type[content_type])
+
+
+def get_indexed_version_count(content_type):
+    return sum(len(versions) for versions in _storage().by_version[content_type].values())
 
 
 def get_indexed_package(content_type, unique_id):
-    return local_storage.by_content_type[content_type].get(unique_id)
+    return _storage().by_content_type[content_type].get(unique_id)
 
 
 def get_indexed_version(content_type, unique_id, upload_date):
-    return local_storage.by_version[content_type].get(unique_id, {}).get(upload_date)
+    return _storage().by_version[content_type].get(unique_id, {}).get(upload_date)
+
+
+def get_indexed_version_by_md5sum_partial(content_type, unique_id, md5sum_partial):
+    return _storage().get_version_by_md5sum_partial(content_type, unique_id, md5sum_partial)
+
+
+def has_indexed_version_name(content_type, unique_id, name):
+    return name in _storage().version_names[content_type].get(unique_id, ())
+
+
+def get_version_dependencies(content_type, unique_id, md5sum_partial):
+    # Returns the (direct) dependencies of a version as tuples of
+    # content-type, unique-id and md5sum-partial.
+    return _storage().dependencies.get((content_type, unique_id, md5sum_partial), ())
+
+
+def get_version_dependents(content_type, unique_id, md5sum_partial):
+    # Returns the versions directly depending on a version, as tuples of
+    # content-type, unique-id and md5sum-partial.
+    return _storage().dependents.get((content_type, unique_id, md5sum_partial), set())
+
+
+def resolve_dependencies(version_keys):
+    # Walk the dependencies of the given versions (tuples of content-type,
+    # unique-id and md5sum-partial), depth-first. Returns a tuple of:
+    # - list of (content-type, unique-id, version) of all versions needed,
+    #   in install order (dependencies before what depends on them);
+    # - list of versions that don't exist;
+    # - list of cycles found, each being the list of versions in the cycle.
+    storage = _storage()
+    order = []
+    missing = []
+    cycles = []
+    # For every version seen, whether we are still walking its dependencies.
+    walking = {}
+
+    stack = []
+
+    def enter(version_key):
+        content_type, unique_id, md5sum_partial = version_key
+        version = storage.get_version_by_md5sum_partial(content_type, unique_id, md5sum_partial)
+
+        if version is None:
+            walking[version_key] = False
+            missing.append(version_key)
+            return
+
+        walking[version_key] = True
+        stack.append((version_key, version, iter(storage.dependencies.get(version_key, ()))))
+
+    for version_key in version_keys:
+        if version_key in walking:
+            continue
+
+        enter(version_key)
+        while stack:
+            current_key, version, dependencies = stack[-1]
+
+            for dependency in dependencies:
+                if dependency not in walking:
+                    enter(dependency)
+                    break
+
+                if walking[dependency]:
+                    keys = [key for key, _, _ in stack]
+                    cycles.append(keys[keys.index(dependency) :])
+            else:
+                stack.pop()
+                walking[current_key] = False
+                order.append((current_key[0], current_key[1], version))
+
+    return order, missing, cycles
+
+
+def search_indexed_packages(query, limit):
+    return _storage().search(query, limit)
 
 
 def get_indexed_packages(content_type=None, user=None):
     if content_type:
-        return local_storage.by_content_type[content_type].values()
+        return _storage().by_content_type[content_type].values()
     if user:
-        return local_storage.by_author[user.method].get(user.id, [])
+        return _storage().by_author[user.method].get(user.id, [])
 
     # Either content_type or user should be set, so throw an exception if
     # neither are. This is a programmers error.
     raise NotImplementedError()
-
-
-def clear_indexed_packages():
-    local_storage.clear()
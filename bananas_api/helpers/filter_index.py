@@ -0,0 +1,140 @@
+from collections import defaultdict
+
+from .api_schema import Classification
+from .enums import Branch
+from .regions import get_regions
+
+# All classification fields can be filtered on; besides those, "region" and
+# "compatibility" can be filtered on too.
+CLASSIFICATION_FILTERS = [field.data_key or name for name, field in Classification().fields.items()]
+FILTERS = CLASSIFICATION_FILTERS + ["region", "compatibility"]
+
+
+def _region_with_parents(region):
+    while region:
+        yield region
+        region = get_regions().get(region, {}).get("parent")
+
+
+def _parse_client_version(version):
+    # Trailing zeros are dropped, so "14" and "14.0" compare as equal.
+    parts = [int(part) for part in version.split(".")]
+    while parts and parts[-1] == 0:
+        parts.pop()
+    return tuple(parts)
+
+
+def _is_compatible(conditions, client_version):
+    for condition in conditions:
+        if condition.startswith(">= "):
+            if client_version < _parse_client_version(condition[3:]):
+                return False
+        elif condition.startswith("< "):
+            if client_version >= _parse_client_version(condition[2:]):
+                return False
+    return True
+
+
+def parse_compatibility(compatibility):
+    # Returns a tuple (branch, client version) for a filter like "vanilla:14.0".
+    # Raises ValueError if it is not valid.
+    branch, _, client_version = compatibility.partition(":")
+    return Branch(branch).value, _parse_client_version(client_version)
+
+
+def _bits(bitmap):
+    # Yields the index of every bit that is set, lowest first.
+    while bitmap:
+        # Take the lowest bit that is set, and clear it.
+        lowest = bitmap & -bitmap
+        yield lowest.bit_length() - 1
+        bitmap ^= lowest
+
+
+class FilterIndex:
+    # Bitmaps (as Python integers) per value of every filter, over all the
+    # versions of a list of dumped packages: bit N is set if version N has
+    # that value. Filters are matched per version, so a package only matches
+    # if a single version matches all filters. Only meant for lists with only
+    # new-games versions, as otherwise old versions would match too.
+    def __init__(self, packages):
+        self.packages = packages
+        # Per bit, the index of the package and the version it is for.
+        self.versions = []
+        self.bitmaps = defaultdict(lambda: defaultdict(int))
+        # Per branch, per unique set of conditions, the versions that have
+        # those conditions for that branch.
+        self.compatibility = defaultdict(lambda: defaultdict(int))
+
+        for package_index, package_data in enumerate(packages):
+            for version in package_data["versions"]:
+                bit = 1 << len(self.versions)
+                self.versions.append((package_index, version))
+
+                for key, value in version.get("classification", {}).items():
+                    # Booleans are given in queries as strings.
+                    if isinstance(value, bool):
+                        value = "true" if value else "false"
+                    self.bitmaps[key][value] |= bit
+
+                # If a version has no regions, it inherits them from the package.
+                for region in version.get("regions", package_data.get("regions", [])):
+                    for parent in _region_with_parents(region):
+                        self.bitmaps["region"][parent] |= bit
+
+                for compatibility in version.get("compatibility", []):
+                    self.compatibility[compatibility["name"]][tuple(compatibility["conditions"])] |= bit
+
+        self.all = (1 << len(self.versions)) - 1
+
+    def _compatible(self, branch, client_version):
+        # Versions without conditions for a branch are compatible with all of
+        # its versions; so remove the ones whose conditions don't match.
+        bitmap = self.all
+        for conditions, versions in self.compatibility.get(branch, {}).items():
+            if not _is_compatible(conditions, client_version):
+                bitmap &= ~versions
+        return bitmap
+
+    def query(self, filters):
+        # "filters" is a dict of filter to list of values; within a filter any
+        # value has to match, and every filter has to match.
+        bitmap = self.all
+
+        for key, values in filters.items():
+            value_bitmap = 0
+            for value in values:
+                if key == "compatibility":
+                    value_bitmap |= self._compatible(*value)
+                else:
+                    value_bitmap |= self.bitmaps.get(key, {}).get(value, 0)
+            bitmap &= value_bitmap
+
+        return bitmap
+
+    def get_packages(self, bitmap):
+        # The packages with at least one version in the bitmap, with only
+        # those versions. Versions are numbered in the order of the
+        # packages, so the packages stay in the order of the list.
+        packages = []
+        last_package_index = None
+        for index in _bits(bitmap):
+            package_index, version = self.versions[index]
+
+            if package_index != last_package_index:
+                packages.append({**self.packages[package_index], "versions": []})
+                last_package_index = package_index
+            packages[-1]["versions"].append(version)
+        return packages
+
+    def _count_packages(self, bitmap):
+        return len({self.versions[index][0] for index in _bits(bitmap)})
+
+    def get_facets(self, bitmap):
+        # Per filter, per value, how many of the packages in the bitmap have
+        # a version with it.
+        facets = {}
+        for key, values in self.bitmaps.items():
+            counts = {value: self._count_packages(bitmap & value_bitmap) for value, value_bitmap in values.items()}
+            facets[key] = {value: count for value, count in sorted(counts.items()) if count}
+        return facets
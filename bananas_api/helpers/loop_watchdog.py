@@ -0,0 +1,129 @@
+import asyncio
+import click
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from aiohttp import web
+from collections import defaultdict
+from openttd_helpers import click_helper
+
+from .web_routes import get_route_name
+
+log = logging.getLogger(__name__)
+
+# When set (in seconds), a thread watches whether the event loop keeps on
+# running callbacks. If it doesn't for longer than this, something is doing
+# blocking work on the loop; the stack of the loop thread at that moment is
+# logged, together with the route that was being handled.
+BLOCK_THRESHOLD = None
+# How many of the innermost frames of the stack to log.
+STACK_LIMIT = 15
+
+# Per route, how often and for how long (in seconds) it blocked the loop.
+_blocked_count = defaultdict(int)
+_blocked_seconds = defaultdict(float)
+
+# Which route every task that is handling a request is for.
+_task_routes = {}
+_last_tick = None
+
+
+@web.middleware
+async def loop_watchdog_middleware(request, handler):
+    task = asyncio.current_task()
+    _task_routes[task] = f"{request.method} {get_route_name(request)}"
+    try:
+        return await handler(request)
+    finally:
+        del _task_routes[task]
+
+
+def _tick(loop, interval):
+    global _last_tick
+
+    _last_tick = time.monotonic()
+    loop.call_later(interval, _tick, loop, interval)
+
+
+def _get_running_route(loop):
+    # Reading this from another thread is safe enough: worst case we read
+    # the task that is just about to start or stop.
+    task = asyncio.current_task(loop)
+    if task is None:
+        return "(no request)"
+    return _task_routes.get(task, "(no request)")
+
+
+def _watchdog(loop, loop_thread_id):
+    interval = BLOCK_THRESHOLD / 2
+    blocked_since = None
+    route = None
+
+    while True:
+        time.sleep(interval)
+
+        last_tick = _last_tick
+        blocked = time.monotonic() - last_tick
+
+        if blocked_since == last_tick:
+            # Still the same stall; account for it once it is over.
+            continue
+        if blocked_since is not None:
+            duration = last_tick - blocked_since
+            _blocked_seconds[route] += duration
+            log.warning("Event loop was blocked for %.0fms while handling %s", duration * 1000, route)
+            blocked_since = None
+
+        if blocked < BLOCK_THRESHOLD:
+            continue
+
+        blocked_since = last_tick
+        route = _get_running_route(loop)
+        _blocked_count[route] += 1
+
+        frame = sys._current_frames().get(loop_thread_id)
+        stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT)) if frame else "(unknown)\n"
+        log.warning(
+            "Event loop is blocked for more than %dms while handling %s; it is at:\n%s",
+            BLOCK_THRESHOLD * 1000,
+            route,
+            stack.rstrip(),
+        )
+
+
+async def _start_loop_watchdog(app):
+    loop = asyncio.get_running_loop()
+    _tick(loop, BLOCK_THRESHOLD / 4)
+
+    threading.Thread(target=_watchdog, args=(loop, threading.get_ident()), daemon=True).start()
+
+
+def setup_loop_watchdog(webapp):
+    if BLOCK_THRESHOLD is None:
+        return
+
+    webapp.middlewares.insert(0, loop_watchdog_middleware)
+    webapp.on_startup.append(_start_loop_watchdog)
+
+
+def get_blocked_stats():
+    # Returns a dict of route to a tuple (times blocked, seconds blocked).
+    return {route: (count, _blocked_seconds[route]) for route, count in list(_blocked_count.items())}
+
+
+@click_helper.extend
+@click.option(
+    "--loop-block-threshold",
+    help="Log the stack when the event loop is blocked for longer than this. (0 = disabled)",
+    default=0,
+    show_default=True,
+    metavar="MILLISECONDS",
+)
+def click_loop_watchdog(loop_block_threshold):
+    global BLOCK_THRESHOLD
+
+    if loop_block_threshold:
+        BLOCK_THRESHOLD = loop_block_threshold / 1000
@@ -0,0 +1,178 @@
+import asyncio
+import bisect
+import time
+
+from aiohttp import web
+from collections import defaultdict
+
+from .content_save import get_pending_changes_count
+from .content_storage import (
+    get_indexed_count,
+    get_indexed_version_count,
+)
+from .enums import ContentType
+from .loop_watchdog import get_blocked_stats
+from .web_routes import get_route_name
+from ..new_upload.session import get_session_count
+
+# Upper bounds (in seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# How often to measure how late the event loop is in running a callback.
+LOOP_LAG_INTERVAL = 1
+
+# Recording a request has to be cheap, so it is only a few increments here;
+# all formatting is done when the metrics are requested.
+_request_count = defaultdict(int)
+# Per (method, route): the count per bucket (plus one for anything slower
+# than the last bucket) and the sum of all durations.
+_request_buckets = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+_request_duration_sum = defaultdict(float)
+_loop_lag = 0.0
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        key = (request.method, get_route_name(request))
+
+        _request_count[key + (status,)] += 1
+        _request_buckets[key][bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+        _request_duration_sum[key] += duration
+
+
+async def _measure_loop_lag():
+    global _loop_lag
+
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        _loop_lag = max(loop.time() - start - LOOP_LAG_INTERVAL, 0.0)
+
+
+async def _start_measure_loop_lag(app):
+    app["loop_lag_task"] = asyncio.get_event_loop().create_task(_measure_loop_lag())
+
+
+async def _stop_measure_loop_lag(app):
+    app["loop_lag_task"].cancel()
+
+
+def setup_metrics(webapp):
+    webapp.middlewares.insert(0, metrics_middleware)
+    webapp.on_startup.append(_start_measure_loop_lag)
+    webapp.on_cleanup.append(_stop_measure_loop_lag)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+def _header(lines, name, type, help):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {type}")
+
+
+def get_process_metrics():
+    # Returns the metrics of this process, as JSON-serializable data. With
+    # multiple workers, these are collected from every process and combined
+    # with format_metrics().
+    return {
+        "requests": [[method, route, status, count] for (method, route, status), count in _request_count.items()],
+        "durations": [
+            [method, route, buckets, _request_duration_sum[(method, route)]]
+            for (method, route), buckets in _request_buckets.items()
+        ],
+        "indexed-packages": {content_type.value: get_indexed_count(content_type) for content_type in ContentType},
+        "indexed-versions": {
+            content_type.value: get_indexed_version_count(content_type) for content_type in ContentType
+        },
+        "upload-sessions": get_session_count(),
+        "pending-commits": get_pending_changes_count(),
+        "loop-lag": _loop_lag,
+        "blocked": [[route, count, seconds] for route, (count, seconds) in get_blocked_stats().items()],
+    }
+
+
+def format_metrics(processes):
+    # Returns the metrics in the Prometheus text format. "processes" is a
+    # list of tuples (name, metrics) as returned by get_process_metrics();
+    # with a name, every series gets a "process" label.
+    lines = []
+
+    def labels(process, **labels):
+        if process is not None:
+            labels["process"] = process
+        return _labels(**labels)
+
+    def sample(name, process, value, **sample_labels):
+        sample_labels = labels(process, **sample_labels)
+        if sample_labels:
+            lines.append(f"{name}{{{sample_labels}}} {value}")
+        else:
+            lines.append(f"{name} {value}")
+
+    _header(lines, "bananas_api_requests_total", "counter", "Amount of requests handled.")
+    for process, metrics in processes:
+        for method, route, status, count in sorted(metrics["requests"]):
+            sample("bananas_api_requests_total", process, count, method=method, route=route, status=status)
+
+    name = "bananas_api_request_duration_seconds"
+    _header(lines, name, "histogram", "Time it took to handle a request.")
+    for process, metrics in processes:
+        for method, route, buckets, duration_sum in sorted(metrics["durations"]):
+            total = 0
+            for bound, count in zip(LATENCY_BUCKETS, buckets):
+                total += count
+                sample(f"{name}_bucket", process, total, method=method, route=route, le=bound)
+            total += buckets[-1]
+            sample(f"{name}_bucket", process, total, method=method, route=route, le="+Inf")
+            sample(f"{name}_sum", process, duration_sum, method=method, route=route)
+            sample(f"{name}_count", process, total, method=method, route=route)
+
+    _header(lines, "bananas_api_indexed_packages", "gauge", "Amount of packages in the index.")
+    for process, metrics in processes:
+        for content_type, count in metrics["indexed-packages"].items():
+            sample("bananas_api_indexed_packages", process, count, content_type=content_type)
+
+    _header(lines, "bananas_api_indexed_versions", "gauge", "Amount of versions in the index.")
+    for process, metrics in processes:
+        for content_type, count in metrics["indexed-versions"].items():
+            sample("bananas_api_indexed_versions", process, count, content_type=content_type)
+
+    _header(lines, "bananas_api_upload_sessions", "gauge", "Amount of active upload sessions.")
+    for process, metrics in processes:
+        sample("bananas_api_upload_sessions", process, metrics["upload-sessions"])
+
+    _header(lines, "bananas_api_pending_commits", "gauge", "Amount of package changes waiting to be committed.")
+    for process, metrics in processes:
+        sample("bananas_api_pending_commits", process, metrics["pending-commits"])
+
+    _header(lines, "bananas_api_event_loop_lag_seconds", "gauge", "How late the event loop last ran a callback.")
+    for process, metrics in processes:
+        sample("bananas_api_event_loop_lag_seconds", process, metrics["loop-lag"])
+
+    _header(lines, "bananas_api_event_loop_blocked_total", "counter", "Times the event loop was blocked too long.")
+    for process, metrics in processes:
+        for route, count, _ in sorted(metrics["blocked"]):
+            sample("bananas_api_event_loop_blocked_total", process, count, route=route)
+    _header(lines, "bananas_api_event_loop_blocked_seconds_total", "counter", "Time the event loop was blocked.")
+    for process, metrics in processes:
+        for route, _, seconds in sorted(metrics["blocked"]):
+            sample("bananas_api_event_loop_blocked_seconds_total", process, seconds, route=route)
+
+    return "\n".join(lines) + "\n"
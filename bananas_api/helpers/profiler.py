@@ -0,0 +1,89 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from collections import Counter
+
+# A statistical profiler: every interval, look at where the threads are.
+# This only costs something while it runs, and doesn't need the process to
+# be started in any special way.
+
+_code_labels = {}
+
+
+def _label(code):
+    label = _code_labels.get(code)
+    if label is None:
+        label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        _code_labels[code] = label
+    return label
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        stack.append(_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return ";".join(stack)
+
+
+def sample_stacks(duration, interval, thread_ids=None):
+    # Returns the stacks in the "collapsed" format most flamegraph tools
+    # accept: per line the frames (outermost first) separated by ";", a
+    # space, and the amount of samples with that stack. Every stack starts
+    # with the name of its thread.
+    own_thread_id = threading.get_ident()
+    samples = Counter()
+
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread_id:
+                continue
+            if thread_ids is not None and thread_id not in thread_ids:
+                continue
+
+            samples[f"{thread_names.get(thread_id, thread_id)};{_collapse(frame)}"] += 1
+
+        time.sleep(interval)
+
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+def start_tracemalloc(frames):
+    tracemalloc.start(frames)
+
+
+def is_tracemalloc_enabled():
+    return tracemalloc.is_tracing()
+
+
+def get_biggest_allocations(limit, group_by):
+    # Returns the "limit" biggest allocations still alive, grouped by
+    # "group_by" (one of "lineno", "filename" or "traceback").
+    snapshot = tracemalloc.take_snapshot()
+    snapshot = snapshot.filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        )
+    )
+    current, peak = tracemalloc.get_traced_memory()
+
+    statistics = []
+    for statistic in snapshot.statistics(group_by)[:limit]:
+        statistics.append(
+            {
+                "size": statistic.size,
+                "count": statistic.count,
+                "traceback": [f"{frame.filename}:{frame.lineno}" for frame in statistic.traceback],
+            }
+        )
+
+    return {"traced-memory": current, "traced-memory-peak": peak, "statistics": statistics}
@@ -0,0 +1,88 @@
+import functools
+
+from marshmallow import fields
+
+
+class Projection:
+    # A compiled "fields" selection. "tree" maps a (data-)key to either None
+    # (include the full value) or the tree for the nested value.
+    def __init__(self, tree):
+        self.tree = tree
+        self.key = ",".join(sorted(_flatten(tree)))
+
+    def apply(self, data):
+        return _apply(data, self.tree)
+
+
+def _flatten(tree, prefix=""):
+    for key, sub_tree in tree.items():
+        if sub_tree is None:
+            yield f"{prefix}{key}"
+        else:
+            yield from _flatten(sub_tree, f"{prefix}{key}.")
+
+
+def _apply(data, tree):
+    if isinstance(data, list):
+        return [_apply(entry, tree) for entry in data]
+
+    result = {}
+    for key, value in data.items():
+        if key not in tree:
+            continue
+
+        sub_tree = tree[key]
+        result[key] = value if sub_tree is None or value is None else _apply(value, sub_tree)
+    return result
+
+
+def _nested_schema(field):
+    if isinstance(field, fields.List):
+        field = field.inner
+    if isinstance(field, fields.Nested):
+        return field.schema
+    return None
+
+
+def _add_to_tree(tree, schema, path, full_name):
+    name, _, rest = path.partition(".")
+
+    for field_name, field in schema.fields.items():
+        if (field.data_key or field_name) == name:
+            break
+    else:
+        raise ValueError(f"unknown field '{full_name}'")
+
+    if not rest:
+        tree[name] = None
+        return
+
+    nested_schema = _nested_schema(field)
+    if nested_schema is None:
+        raise ValueError(f"field '{full_name}' has no subfields")
+
+    # Selecting the whole field wins over selecting some of its subfields.
+    if name in tree and tree[name] is None:
+        return
+    _add_to_tree(tree.setdefault(name, {}), nested_schema, rest, full_name)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_projection(schema_class, names):
+    # "names" is a comma-separated list of (data-)keys of the schema; subfields
+    # of nested fields are selected with a dot, like "versions.version".
+    # Raises ValueError if any of the fields is invalid.
+    schema = schema_class()
+    tree = {}
+
+    for name in names.split(","):
+        name = name.strip()
+        if not name:
+            continue
+
+        _add_to_tree(tree, schema, name, name)
+
+    if not tree:
+        raise ValueError("no fields given")
+
+    return Projection(tree)
@@ -0,0 +1,127 @@
+import datetime
+
+from marshmallow import (
+    fields,
+    missing,
+    RAISE,
+)
+from marshmallow.decorators import (
+    POST_LOAD,
+    PRE_LOAD,
+)
+from marshmallow.exceptions import ValidationError
+
+# The counterpart of schema_dump: generate (once) a plain Python function per
+# schema that loads data like schema().load() would, but without running any
+# of the validators. This is meant for data that is known to be valid (like
+# the index on startup, which is validated before it is ever committed); it
+# only does the type conversions marshmallow would do (enums, datetimes, ..).
+#
+# Values of an unexpected type are passed to the deserialize() of the field,
+# which either converts them like marshmallow would, or raises a
+# ValidationError. Unknown keys raise a ValidationError, like marshmallow.
+
+
+class _Compiler:
+    def __init__(self):
+        self.namespace = {
+            "_missing": missing,
+            "_fromisoformat": datetime.datetime.fromisoformat,
+            "_ValidationError": ValidationError,
+        }
+        self.functions = {}
+        self.source = []
+
+    def _add_global(self, prefix, value):
+        name = f"_{prefix}_{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def _expression(self, field, value, attr_name, depth):
+        deserialize = self._add_global("deserialize", field.deserialize)
+        fallback = f"{deserialize}({value}, {attr_name!r}, data)"
+
+        if field.allow_none:
+            none_check = f"None if {value} is None else "
+        else:
+            none_check = ""
+
+        if type(field) is fields.String:
+            return f"({none_check}({value} if {value}.__class__ is str else {fallback}))"
+
+        if type(field) is fields.Integer:
+            return f"({none_check}({value} if {value}.__class__ is int else {fallback}))"
+
+        if type(field) is fields.Boolean:
+            return f"({none_check}({value} if {value} is True or {value} is False else {fallback}))"
+
+        if type(field) is fields.Enum and field.by_value is True:
+            enum = self._add_global("enum", field.enum)
+            return f"({none_check}{enum}({value}))"
+
+        if type(field) is fields.DateTime and field.format in (None, "iso"):
+            return f"({none_check}(_fromisoformat({value}) if {value}.__class__ is str else {fallback}))"
+
+        if type(field) is fields.List:
+            entry = f"entry{depth}"
+            inner = self._expression(field.inner, entry, attr_name, depth + 1)
+            return f"({none_check}([{inner} for {entry} in {value}] if {value}.__class__ is list else {fallback}))"
+
+        if type(field) is fields.Nested and not field.many and not field.schema.many:
+            function = self.compile(field.schema)
+            return f"({none_check}({function}({value}) if {value}.__class__ is dict else {fallback}))"
+
+        return fallback
+
+    def compile(self, schema):
+        if schema.__class__ in self.functions:
+            return self.functions[schema.__class__]
+
+        if schema._hooks[PRE_LOAD] or schema._hooks[POST_LOAD]:
+            raise NotImplementedError(f"{schema.__class__.__name__} has load hooks")
+        if schema.only or schema.exclude or schema.many or schema.dict_class is not dict:
+            raise NotImplementedError(f"{schema.__class__.__name__} has unsupported options")
+        if schema.unknown != RAISE:
+            raise NotImplementedError(f"{schema.__class__.__name__} doesn't raise on unknown fields")
+
+        name = f"_load_{schema.__class__.__name__}_{len(self.functions)}"
+        self.functions[schema.__class__] = name
+
+        known_keys = frozenset(field.data_key or attr_name for attr_name, field in schema.load_fields.items())
+        known_keys = self._add_global("known_keys", known_keys)
+        unknown_message = schema.error_messages["unknown"]
+
+        lines = [
+            f"def {name}(data):",
+            f"    unknown = data.keys() - {known_keys}",
+            "    if unknown:",
+            f"        raise _ValidationError({{key: [{unknown_message!r}] for key in sorted(unknown)}})",
+            "    result = {}",
+        ]
+        for attr_name, field in schema.load_fields.items():
+            attribute = field.attribute or attr_name
+            key = field.data_key or attr_name
+
+            if "." in attribute:
+                raise NotImplementedError(f"{schema.__class__.__name__}.{attr_name} has an unsupported attribute")
+            if field.load_default is not missing:
+                raise NotImplementedError(f"{schema.__class__.__name__}.{attr_name} has a load_default")
+
+            lines.append(f"    value = data.get({key!r}, _missing)")
+            lines.append("    if value is not _missing:")
+            lines.append(f"        result[{attribute!r}] = {self._expression(field, 'value', attr_name, 0)}")
+        lines.append("    return result")
+
+        self.source.append("\n".join(lines))
+        return name
+
+
+def compile_load(schema_class):
+    # Returns a function that, given a dict of valid data, returns the same
+    # as schema_class().load() would.
+    compiler = _Compiler()
+    name = compiler.compile(schema_class())
+
+    code = compile("\n\n".join(compiler.source), f"<load {schema_class.__name__}>", "exec")
+    exec(code, compiler.namespace)
+    return compiler.namespace[name]
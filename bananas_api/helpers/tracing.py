@@ -0,0 +1,141 @@
+import click
+import contextlib
+import contextvars
+import json
+import logging
+import secrets
+import threading
+import time
+
+from collections import deque
+from openttd_helpers import click_helper
+
+log = logging.getLogger(__name__)
+
+# Lightweight tracing of the stages a new upload goes through. A span is one
+# stage; every span belongs to a trace, which for uploads is the upload-token.
+# Spans started while another span is active are its children, and inherit
+# its trace.
+#
+# Finished spans are handed to the exporter; without one, spans cost next
+# to nothing.
+
+_exporter = None
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = {}
+        self.error = None
+        self.start = time.time()
+        self.duration = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, value):
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace-id": self.trace_id,
+            "span-id": self.span_id,
+            "parent-id": self.parent_id,
+            "start": self.start,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoSpan:
+    # Used when there is no exporter; it accepts everything and does nothing.
+    def set(self, key, value):
+        pass
+
+    def add(self, key, value):
+        pass
+
+
+_no_span = _NoSpan()
+
+
+@contextlib.contextmanager
+def span(name, trace_id=None, **attributes):
+    if _exporter is None:
+        yield _no_span
+        return
+
+    parent = _current_span.get()
+    if trace_id is None and parent is not None:
+        trace_id = parent.trace_id
+
+    new_span = Span(name, trace_id, parent)
+    new_span.attributes.update(attributes)
+
+    token = _current_span.set(new_span)
+    start = time.perf_counter()
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.error = f"{e.__class__.__name__}: {e}"
+        raise
+    finally:
+        new_span.duration = time.perf_counter() - start
+        _current_span.reset(token)
+
+        try:
+            _exporter.export(new_span)
+        except Exception:
+            log.exception("Failed to export span")
+
+
+class InMemoryExporter:
+    # Keeps the last "size" spans; mostly useful for tests and debugging.
+    def __init__(self, size=10000):
+        self.spans = deque(maxlen=size)
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def get_spans(self, trace_id=None):
+        return [span for span in list(self.spans) if trace_id is None or span.trace_id == trace_id]
+
+    def clear(self):
+        self.spans.clear()
+
+
+class JSONLinesExporter:
+    # Appends every span as a single line of JSON to a file.
+    def __init__(self, filename):
+        self._fp = open(filename, "a")
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._fp.write(line + "\n")
+            self._fp.flush()
+
+
+def set_exporter(exporter):
+    global _exporter
+
+    _exporter = exporter
+
+
+@click_helper.extend
+@click.option(
+    "--tracing-file",
+    help="File to append tracing spans of new uploads to, as JSON lines.",
+    type=click.Path(dir_okay=False),
+)
+def click_tracing(tracing_file):
+    if tracing_file:
+        set_exporter(JSONLinesExporter(tracing_file))
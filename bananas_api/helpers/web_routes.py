@@ -1,22 +1,76 @@
+import click
 import dateutil.parser
 import json
 
 from aiohttp import web
+from openttd_helpers import click_helper
 
 from .enums import ContentType
+from .filter_index import (
+    FILTERS,
+    parse_compatibility,
+)
+from .projection import compile_projection
 from .user_session import (
     get_user_by_bearer,
     get_user_methods,
 )
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BATCH_SIZE_MAX = 5000
+BATCH_ENTRY_FIELDS = ("content-type", "unique-id", "md5sum-partial")
+CONTENT_TYPES = {content_type.value: content_type for content_type in ContentType}
+HEX_CHARACTERS = frozenset("abcdef1234567890")
+
+
+def _json_dumps_stdlib(data):
+    return json.dumps(data).encode()
+
+
+def _json_dumps_orjson(data):
+    # Validation errors use the index of a list entry as key.
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+
+# Use orjson if it is installed; it is several times faster than the
+# stdlib encoder, which matters for the bigger responses.
+_json_dumps = _json_dumps_orjson if orjson else _json_dumps_stdlib
+
+
+def json_dumps(data):
+    # Returns the encoded JSON as bytes, ready to be used as body.
+    return _json_dumps(data)
+
+
+def json_response(data, *, status=200, reason=None, headers=None):
+    return web.Response(
+        body=json_dumps(data), status=status, reason=reason, headers=headers, content_type="application/json"
+    )
+
 
 class JSONException(web.HTTPException):
-    def __init__(
-        self, data, *, status=400, reason=None, headers=None, content_type="application/json", dumps=json.dumps
-    ):
+    def __init__(self, data, *, status=400, reason=None, headers=None, content_type="application/json", dumps=None):
         self.status_code = status
-        text = dumps(data)
-        super().__init__(text=text, reason=reason, headers=headers, content_type=content_type)
+        body = dumps(data).encode() if dumps else json_dumps(data)
+        super().__init__(body=body, reason=reason, headers=headers, content_type=content_type)
+
+
+def _is_hex_id(value):
+    # Unique-ids and md5sum-partials are both 8 lowercase hexadecimal characters.
+    return isinstance(value, str) and len(value) == 8 and HEX_CHARACTERS.issuperset(value)
+
+
+def get_route_name(request):
+    # The route as registered (like "/package/{content_type}"); unlike the
+    # path, there is only a limited amount of these.
+    resource = request.match_info.route.resource
+    if resource is None:
+        return "unknown"
+    return resource.canonical
 
 
 def in_path_content_type(content_type):
@@ -110,6 +164,156 @@ def in_query_since(since):
     return since
 
 
+def in_query_limit(limit):
+    if limit is None:
+        return None
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise JSONException({"message": "limit is not a valid number"})
+
+    if limit < 1:
+        raise JSONException({"message": "limit should be at least 1"})
+
+    return limit
+
+
+def in_query_fields(fields, schema_class):
+    if fields is None:
+        return None
+
+    try:
+        return compile_projection(schema_class, fields)
+    except ValueError as e:
+        raise JSONException({"message": f"fields is invalid: {e}"})
+
+
+def in_query_after(after):
+    # The sequence as returned by /package/changes: "<boot-id>.<generation>".
+    # Returns a tuple of the boot-id and the generation.
+    if after is None:
+        return None
+
+    boot_id, _, generation = after.partition(".")
+    try:
+        generation = int(generation)
+    except ValueError:
+        raise JSONException({"message": "after is not a valid sequence"})
+
+    if not boot_id or generation < 0:
+        raise JSONException({"message": "after is not a valid sequence"})
+
+    return boot_id, generation
+
+
+def in_query_search(q):
+    if not q or not q.strip():
+        raise JSONException({"message": "q is missing"})
+    if len(q) > 256:
+        raise JSONException({"message": "q is too long"})
+
+    return q
+
+
+def in_query_filters(query):
+    # A filter can be given more than once; any of the values matches.
+    filters = {}
+    for key in FILTERS:
+        values = query.getall(key, [])
+        if not values:
+            continue
+
+        if key == "compatibility":
+            try:
+                values = [parse_compatibility(value) for value in values]
+            except ValueError:
+                raise JSONException({"message": "compatibility should be in the form of 'vanilla:14.0'"})
+
+        filters[key] = values
+
+    return filters
+
+
+def in_query_md5sum_partial(md5sum_partial):
+    if md5sum_partial is None:
+        return None
+
+    if not _is_hex_id(md5sum_partial):
+        raise JSONException({"message": "md5sum-partial is invalid"})
+
+    return md5sum_partial
+
+
+def in_query_cursor(cursor):
+    if cursor is None:
+        return None
+
+    # The cursor is the unique-id of the last package of the previous page.
+    if not _is_hex_id(cursor):
+        raise JSONException({"message": "cursor is invalid"})
+
+    return cursor
+
+
+def _batch_entry_errors(entry):
+    if not isinstance(entry, dict):
+        return ["Invalid input type."]
+
+    errors = {}
+    for key in BATCH_ENTRY_FIELDS:
+        if key not in entry:
+            errors[key] = ["Missing data for required field."]
+        elif key == "content-type":
+            if not isinstance(entry[key], str) or entry[key] not in CONTENT_TYPES:
+                errors[key] = [f"Must be one of: {', '.join(CONTENT_TYPES)}."]
+        elif not _is_hex_id(entry[key]):
+            errors[key] = ["Must be 8 hexadecimal characters."]
+
+    if len(entry) != len(BATCH_ENTRY_FIELDS) or errors:
+        for key in entry:
+            if key not in BATCH_ENTRY_FIELDS:
+                errors[key] = ["Unknown field."]
+
+    return errors
+
+
+def in_body_batch(data):
+    # The body of a batch lookup: {"packages": [...]}, with for every entry
+    # the content-type, unique-id and md5sum-partial. This can be thousands
+    # of entries, so it is validated by hand instead of by marshmallow; the
+    # errors are in the same format. Returns a list of tuples of
+    # content-type, unique-id and md5sum-partial.
+    if not isinstance(data, dict):
+        errors = {"_schema": ["Invalid input type."]}
+    else:
+        errors = {key: ["Unknown field."] for key in data if key != "packages"}
+        packages = data.get("packages")
+
+        if "packages" not in data:
+            errors["packages"] = ["Missing data for required field."]
+        elif not isinstance(packages, list):
+            errors["packages"] = ["Not a valid list."]
+        elif len(packages) > BATCH_SIZE_MAX:
+            errors["packages"] = [f"Longer than maximum length {BATCH_SIZE_MAX}."]
+        else:
+            entry_errors = {}
+            for index, entry in enumerate(packages):
+                entry_error = _batch_entry_errors(entry)
+                if entry_error:
+                    entry_errors[index] = entry_error
+            if entry_errors:
+                errors["packages"] = entry_errors
+
+    if errors:
+        raise JSONException({"message": "request body failed validation", "errors": errors})
+
+    return [
+        (CONTENT_TYPES[entry["content-type"]], entry["unique-id"], entry["md5sum-partial"])
+        for entry in data["packages"]
+    ]
+
+
 def in_query_authorize_audience(audience):
     if audience is None:
         raise JSONException({"message": "audience is not set in query-string"})
@@ -208,3 +412,24 @@ def in_post_token_redirect_uri(redirect_uri):
         raise JSONException({"message": "redirect_uri is not set in POST JSON body"})
 
     return _redirect_uri(redirect_uri)
+
+
+@click_helper.extend
+@click.option(
+    "--json-encoder",
+    help="JSON encoder to use for responses (auto uses orjson if installed).",
+    type=click.Choice(["auto", "orjson", "stdlib"], case_sensitive=False),
+    default="auto",
+    show_default=True,
+)
+def click_json_encoder(json_encoder):
+    global _json_dumps
+
+    if json_encoder == "orjson":
+        if orjson is None:
+            raise click.UsageError("--json-encoder orjson requires the orjson package to be installed")
+        _json_dumps = _json_dumps_orjson
+    elif json_encoder == "stdlib":
+        _json_dumps = _json_dumps_stdlib
+    else:
+        _json_dumps = _json_dumps_orjson if orjson else _json_dumps_stdlib
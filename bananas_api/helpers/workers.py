@@ -0,0 +1,265 @@
+import aiohttp
+import asyncio
+import gc
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+
+from aiohttp import web
+from multidict import CIMultiDict
+
+log = logging.getLogger(__name__)
+
+# With more than one worker, the index is loaded once, after which the
+# process forks into:
+#  - one writer, which handles everything that changes state (uploads,
+#    publishing, edits, user sessions, reloads, ..). It only listens on a
+#    port on localhost.
+#  - N readers, which all listen on the web port (with SO_REUSEPORT, so the
+#    kernel balances connections over them). They serve everything that only
+#    reads the index, and proxy any other request to the writer.
+# The first process stays around as supervisor; it relays "the index on disk
+# changed" from the writer to the readers, which then reload from disk.
+#
+# Every worker also listens on a port of its own on localhost; this is how
+# the other workers can reach a specific worker (for example, to collect its
+# metrics), as the web port goes to whichever reader the kernel picks.
+
+INDEX_CHANGED_SIGNAL = signal.SIGUSR1
+# Header the readers use to tell the writer the remote address of a request.
+REMOTE_HEADER = "X-Bananas-Api-Remote"
+PROXY_CHUNK_SIZE = 64 * 1024
+
+# Headers that only apply to a single connection, so should never be proxied.
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+}
+
+_children = {}
+_readers = set()
+_stopping = False
+# Name of this worker; None when not running with multiple workers.
+_worker_name = None
+# Per worker name, the port it listens on on localhost.
+_worker_ports = {}
+
+
+def _filter_headers(headers):
+    return CIMultiDict((key, value) for key, value in headers.items() if key.lower() not in HOP_BY_HOP_HEADERS)
+
+
+def create_proxy_middleware(writer_port, local_handlers):
+    # Requests handled by any of "local_handlers" are served by the reader
+    # itself; all others are proxied to the writer.
+    base_url = f"http://127.0.0.1:{writer_port}"
+
+    @web.middleware
+    async def proxy_middleware(request, handler):
+        if request.match_info.route.handler in local_handlers:
+            return await handler(request)
+
+        headers = _filter_headers(request.headers)
+        headers[REMOTE_HEADER] = request.remote or ""
+
+        session = request.app["writer_session"]
+        try:
+            async with session.request(
+                request.method,
+                f"{base_url}{request.rel_url}",
+                headers=headers,
+                data=request.content if request.body_exists else None,
+                allow_redirects=False,
+            ) as writer_response:
+                response = web.StreamResponse(
+                    status=writer_response.status,
+                    reason=writer_response.reason,
+                    headers=_filter_headers(writer_response.headers),
+                )
+                await response.prepare(request)
+                async for chunk in writer_response.content.iter_chunked(PROXY_CHUNK_SIZE):
+                    await response.write(chunk)
+                await response.write_eof()
+                return response
+        except aiohttp.ClientError:
+            log.exception("Failed to proxy request to the writer")
+            return web.HTTPBadGateway()
+
+    return proxy_middleware
+
+
+async def _start_writer_session(app):
+    # The body and its encoding are passed on as-is; so don't let the client
+    # add or undo anything.
+    app["writer_session"] = aiohttp.ClientSession(
+        auto_decompress=False,
+        skip_auto_headers=("Accept-Encoding", "User-Agent", "Content-Type"),
+    )
+
+
+async def _stop_writer_session(app):
+    await app["writer_session"].close()
+
+
+def setup_reader_app(webapp, writer_port, local_handlers):
+    webapp.middlewares.append(create_proxy_middleware(writer_port, local_handlers))
+    webapp.on_startup.append(_start_writer_session)
+    webapp.on_cleanup.append(_stop_writer_session)
+
+
+@web.middleware
+async def writer_remote_middleware(request, handler):
+    # Requests proxied by a reader come from localhost; use the address the
+    # reader saw instead.
+    if REMOTE_HEADER in request.headers:
+        request = request.clone(remote=request.headers[REMOTE_HEADER])
+    return await handler(request)
+
+
+def get_worker_name():
+    return _worker_name
+
+
+def get_worker_names():
+    return list(_worker_ports)
+
+
+async def forward_to_worker(request, name, data):
+    # Sends the request, with "data" as JSON body, to the worker "name" on
+    # its own port, and returns its response. Only readers can do this.
+    session = request.app["writer_session"]
+    try:
+        async with session.request(
+            request.method,
+            f"http://127.0.0.1:{_worker_ports[name]}{request.rel_url}",
+            headers={"Content-Type": "application/json"},
+            data=json.dumps(data).encode(),
+        ) as worker_response:
+            return web.Response(
+                status=worker_response.status,
+                headers=_filter_headers(worker_response.headers),
+                body=await worker_response.read(),
+            )
+    except aiohttp.ClientError:
+        log.exception("Failed to forward request to %s", name)
+        return web.HTTPBadGateway()
+
+
+async def collect_from_workers(app, path):
+    # Requests "path" from every other worker, and returns a list of tuples
+    # (worker name, decoded JSON). Workers that fail to answer are left out.
+    session = app["writer_session"]
+
+    async def collect(name, port):
+        try:
+            async with session.get(f"http://127.0.0.1:{port}{path}") as response:
+                response.raise_for_status()
+                return name, json.loads(await response.read())
+        except aiohttp.ClientError:
+            log.exception("Failed to collect %s from %s", path, name)
+            return None
+
+    results = await asyncio.gather(
+        *(collect(name, port) for name, port in _worker_ports.items() if name != _worker_name)
+    )
+    return [result for result in results if result is not None]
+
+
+def notify_index_changed():
+    # Called by the writer; the supervisor relays it to all readers.
+    os.kill(os.getppid(), INDEX_CHANGED_SIGNAL)
+
+
+def _relay_index_changed(signum, frame):
+    for pid in _readers:
+        os.kill(pid, signum)
+
+
+def _stop_children(signum, frame):
+    global _stopping
+
+    _stopping = True
+    for pid in _children:
+        os.kill(pid, signal.SIGTERM)
+
+
+def _fork(name, function, *args):
+    global _worker_name
+
+    pid = os.fork()
+    if pid == 0:
+        _worker_name = name
+        try:
+            function(*args)
+        except Exception:
+            log.exception("%s crashed", name)
+            os._exit(1)
+        os._exit(0)
+
+    _children[pid] = name
+    return pid
+
+
+def run_workers(workers, run_writer, run_reader):
+    # "run_writer" is called with the (already listening) socket for the
+    # writer; "run_reader" with the port of that socket, and the (already
+    # listening) socket for that reader on localhost. Both are called in a
+    # forked process, and should only return when that process is done.
+    writer_socket = socket.create_server(("127.0.0.1", 0))
+    writer_port = writer_socket.getsockname()[1]
+    _worker_ports["writer"] = writer_port
+
+    reader_sockets = {}
+    for i in range(workers):
+        reader_sockets[f"reader {i}"] = socket.create_server(("127.0.0.1", 0))
+        _worker_ports[f"reader {i}"] = reader_sockets[f"reader {i}"].getsockname()[1]
+
+    # Everything that exists now (mostly the index) is never going to be
+    # freed by the garbage collector; by moving it out of its reach, the
+    # garbage collector in the workers no longer writes to the memory pages
+    # it is in, keeping them shared between all workers.
+    gc.collect()
+    gc.freeze()
+
+    # Till the readers installed their own handler, ignore the signal
+    # instead of being terminated by it.
+    signal.signal(INDEX_CHANGED_SIGNAL, signal.SIG_IGN)
+
+    _fork("writer", run_writer, writer_socket)
+    writer_socket.close()
+    for name, reader_socket in reader_sockets.items():
+        _readers.add(_fork(name, run_reader, writer_port, reader_socket))
+        reader_socket.close()
+
+    signal.signal(INDEX_CHANGED_SIGNAL, _relay_index_changed)
+    signal.signal(signal.SIGTERM, _stop_children)
+    signal.signal(signal.SIGINT, _stop_children)
+
+    log.info("Started writer and %d readers", workers)
+
+    exit_code = 0
+    while _children:
+        pid, status = os.wait()
+        name = _children.pop(pid)
+        _readers.discard(pid)
+
+        if _stopping:
+            continue
+
+        # Any worker stopping unexpectedly means we are no longer serving
+        # requests correctly; stop all, so whatever started us can restart.
+        log.error("Worker %s stopped unexpectedly (status %d); stopping all workers", name, status)
+        exit_code = 1
+        _stop_children(signal.SIGTERM, None)
+
+    sys.exit(exit_code)
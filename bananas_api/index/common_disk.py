@@ -1,28 +1,56 @@
+import click
+import contextlib
+import json
 import logging
+import multiprocessing
 import os
+import pickle
+import traceback
 import yaml
 
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from openttd_helpers import click_helper
 
 from ..helpers.api_schema import (
     Authors,
+    dump_package,
+    dump_version,
+    dump_version_minimized,
+    get_dependency_error,
     Global,
+    load_package_unvalidated,
     Package,
     set_dependency_check,
+    Version,
     VersionMinimized,
 )
 from ..helpers.content_storage import (
     add_to_blacklist,
-    clear_indexed_packages,
+    build_local_storage,
     get_highest_scenario_heightmap_id,
     get_indexed_count,
+    get_indexed_packages,
     index_package,
     set_if_higher_scenario_heightmap_id,
+    unindex_package,
 )
 from ..helpers.enums import ContentType
 
 log = logging.getLogger(__name__)
 
+# Amount of entries a worker process parses in one go when loading in
+# parallel; this keeps the pickle overhead per entry low.
+LOAD_CHUNKSIZE = 64
+
+# Increase this whenever the in-memory representation of a package changes;
+# this invalidates all existing snapshots.
+SNAPSHOT_VERSION = 1
+
+_load_workers = 1
+_snapshot_file = None
+
 
 class key_string(str):
     pass
@@ -95,7 +123,7 @@ class Index:
         else:
             return version_data
 
-    def _read_content_entry(self, content_type, category, unique_id):
+    def _read_content_entry(self, content_type, category, unique_id, validate=True):
         path = f"{category}/{unique_id}"
 
         with open(f"{self.folder}/{path}/global.yaml") as f:
@@ -121,11 +149,27 @@ class Index:
         package_data["content-type"] = content_type.value
         package_data["unique-id"] = unique_id
 
+        # Validating every entry is by far the slowest part of loading the
+        # index. Only the changed entries of an index can be invalid (the
+        # rest was validated before it was committed), so bulk-loads skip
+        # validation unless asked for.
+        if not validate:
+            return load_package_unvalidated(package_data)
+
         return Package().load(package_data)
 
     def reload(self):
-        clear_indexed_packages()
-        self.load_all()
+        return self.reload_from_disk()
+
+    def reload_from_disk(self):
+        # Unlike reload(), this never fetches anything; it only reads what is
+        # on disk. This is what processes that only serve the index use.
+        # A full reload means it is unknown what changed on disk, so every
+        # entry is validated.
+        with build_local_storage() as storage:
+            self.load_all(validate_entries=True)
+
+        return storage
 
     def commit(self):
         pass
@@ -133,22 +177,34 @@ class Index:
     def push_changes(self):
         pass
 
-    def load_all(self, validate=False):
-        # Because we are loaded the content, there is no way to already do
-        # dependency validation. So for now, disable it. After we loaded
-        # everything, we will give it another pass to validate dependencies.
-        set_dependency_check(False)
+    def before_fork(self):
+        pass
 
-        version_dep_check = []
+    def lock(self, shared=False):
+        # Without a known place to share a lock between processes, there is
+        # nothing to lock.
+        return contextlib.nullcontext()
+
+    def _list_entries(self):
+        # Always walk the folders in the same order, so the resulting index
+        # is identical no matter how the entries are read.
+        entries = []
         for content_type in ContentType:
             folder_name = f"{self.folder}/{content_type.value}"
 
             if not os.path.isdir(folder_name):
                 continue
 
-            for unique_id in os.listdir(folder_name):
+            for unique_id in sorted(os.listdir(folder_name)):
+                entries.append((content_type, unique_id))
+
+        return entries
+
+    def _read_entries(self, entries, validate, validate_entries):
+        if _load_workers == 1:
+            for content_type, unique_id in entries:
                 try:
-                    package = self._read_content_entry(content_type, content_type.value, unique_id)
+                    package = self._read_content_entry(content_type, content_type.value, unique_id, validate_entries)
                 except Exception:
                     # During validation, any error is enough to bail out
                     if validate:
@@ -157,38 +213,214 @@ class Index:
                     log.exception(f"Failed to load entry {content_type.value}/{unique_id}. Skipping.")
                     continue
 
-                # Return of None means package is blacklisted
-                if package is None:
-                    add_to_blacklist(content_type, unique_id)
+                yield content_type, unique_id, package
+
+            return
+
+        # This also runs on reloads, from a thread while the event loop (and
+        # other threads) are running. Forking such a process is unsafe; so
+        # start the workers as fresh processes instead. (A fork server is no
+        # option either; it is not shared with the processes of --workers.)
+        with ProcessPoolExecutor(
+            max_workers=_load_workers or None,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=set_dependency_check,
+            initargs=(False,),
+        ) as executor:
+            results = executor.map(
+                partial(_read_content_entry_in_worker, self.folder, validate_entries), entries, chunksize=LOAD_CHUNKSIZE
+            )
+
+            # "map" returns the results in the order of the entries, so we
+            # merge them in exactly the same order as the serial path does.
+            for (content_type, unique_id), (package, error) in zip(entries, results):
+                if error:
+                    # During validation, any error is enough to bail out
+                    if validate:
+                        raise Exception(f"Failed to load entry {content_type.value}/{unique_id}:\n{error}")
+
+                    log.error(f"Failed to load entry {content_type.value}/{unique_id}. Skipping.\n{error}")
                     continue
 
-                index_package(package)
+                yield content_type, unique_id, package
+
+    def get_snapshot_key(self):
+        # Without knowing what the state of the folder is, there is no way
+        # to tell whether a snapshot is still valid.
+        return None
+
+    def _load_snapshot(self, snapshot_key):
+        try:
+            with open(_snapshot_file, "rb") as fp:
+                header = pickle.load(fp)
+                if header != {"version": SNAPSHOT_VERSION, "key": snapshot_key}:
+                    log.info("Index snapshot is outdated; loading index from disk")
+                    return False
+
+                snapshot = pickle.load(fp)
+        except FileNotFoundError:
+            return False
+        except Exception:
+            log.exception("Failed to read index snapshot; loading index from disk")
+            return False
+
+        for content_type, unique_id, package in snapshot:
+            self._index_entry(content_type, unique_id, package)
+
+        self._log_loaded(dict.fromkeys(content_type for content_type, _, _ in snapshot))
+        log.info("Loaded index from snapshot of %s", snapshot_key)
+        return True
+
+    def _write_snapshot(self, snapshot_key, snapshot):
+        # Write to a temporary file first, so a crash halfway never leaves a
+        # corrupted snapshot behind. With multiple workers, several processes
+        # can be doing this at the same time.
+        tmp_file = f"{_snapshot_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, "wb") as fp:
+                pickle.dump({"version": SNAPSHOT_VERSION, "key": snapshot_key}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(snapshot, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, _snapshot_file)
+        except Exception:
+            log.exception("Failed to write index snapshot")
+
+    def _index_entry(self, content_type, unique_id, package):
+        # Return of None means package is blacklisted
+        if package is None:
+            add_to_blacklist(content_type, unique_id)
+            return
+
+        index_package(package)
+
+        # Scenarios and heightmap share their index in the OpenTTD client.
+        # Their unique-id is also assigned by us (and not the user as with
+        # all the other content). As such, find the highest currently used
+        # number, and store that.
+        if content_type in (ContentType.SCENARIO, ContentType.HEIGHTMAP):
+            set_if_higher_scenario_heightmap_id(int(unique_id, 16))
+
+    def _log_loaded(self, content_types):
+        for content_type in content_types:
+            log.info("Loaded %d entries for %s", get_indexed_count(content_type), content_type.value)
 
-                for version in package["versions"]:
-                    version_dep_check.append(version)
+        log.info("Highest unique-id used by scenario/heightmap is %d", get_highest_scenario_heightmap_id())
 
-                # Scenarios and heightmap share their index in the OpenTTD client.
-                # Their unique-id is also assigned by us (and not the user as with
-                # all the other content). As such, find the highest currently used
-                # number, and store that.
-                if content_type in (ContentType.SCENARIO, ContentType.HEIGHTMAP):
-                    set_if_higher_scenario_heightmap_id(int(unique_id, 16))
+    def load_all(self, validate=False, validate_entries=False):
+        # "validate" validates every entry, and stops at the first error;
+        # "validate_entries" only validates every entry, skipping the ones
+        # that fail.
+        # A snapshot is only used when it was made of exactly the same state
+        # of the index. When validating, always read all the files.
+        snapshot_key = None
+        if _snapshot_file and not validate and not validate_entries:
+            snapshot_key = self.get_snapshot_key()
 
-            log.info("Loaded %d entries for %s", get_indexed_count(content_type), content_type.value)
+            if snapshot_key and self._load_snapshot(snapshot_key):
+                return
 
-        log.info("Highest unique-id used by scenario/heightmap is %d", get_highest_scenario_heightmap_id())
+        # Because we are loaded the content, there is no way to already do
+        # dependency validation. So for now, disable it. After we loaded
+        # everything, we will give it another pass to validate dependencies.
+        set_dependency_check(False)
+
+        entries = self._list_entries()
+
+        snapshot = []
+        version_dep_check = []
+        for content_type, unique_id, package in self._read_entries(entries, validate, validate or validate_entries):
+            self._index_entry(content_type, unique_id, package)
+            snapshot.append((content_type, unique_id, package))
+
+            if package is not None:
+                for version in package["versions"]:
+                    version_dep_check.append(version)
+
+        self._log_loaded(dict.fromkeys(content_type for content_type, _ in entries))
 
         set_dependency_check(True)
 
         # Validate all loaded versions, this time with dependency checking on.
         # This to make sure we are in a consistent state.
-        for version in version_dep_check:
-            errors = VersionMinimized().validate(VersionMinimized().dump(version))
-            if errors:
-                raise Exception("Failed to load content entries: %r" % errors)
+        self._validate_dependencies(version_dep_check)
+
+        if validate:
+            self._validate_dump([package for _, _, package in snapshot if package is not None])
+
+        if snapshot_key:
+            self._write_snapshot(snapshot_key, snapshot)
+
+    def _validate_dump(self, packages):
+        # The precompiled dump functions should give exactly the same output
+        # as marshmallow does. Validate this for the whole index, so any
+        # difference is found long before it is served.
+        def check(schema_class, dump, data):
+            expected = json.dumps(schema_class().dump(data))
+            if json.dumps(dump(data)) != expected:
+                raise Exception(
+                    f"Precompiled dump of {schema_class.__name__} differs for "
+                    f"{data['content_type'].value}/{data['unique_id']}: {expected}"
+                )
+
+        for package in packages:
+            check(Package, dump_package, package)
+
+            for version in package["versions"]:
+                version_data = {**version, "content_type": package["content_type"], "unique_id": package["unique_id"]}
+                check(Version, dump_version, version_data)
+                check(VersionMinimized, dump_version_minimized, version_data)
+
+    def _validate_dependencies(self, versions):
+        # All other fields are already validated while loading the entry; so
+        # only the dependencies need checking, now everything is indexed.
+        for version in versions:
+            for dependency in version.get("dependencies", []):
+                error = get_dependency_error(dependency)
+                if error:
+                    raise Exception("Failed to load content entries: %r" % error)
+
+    def reload_entries(self, entries):
+        # Only reload the given entries; everything else in the index is
+        # left untouched.
+        set_dependency_check(False)
+
+        for content_type, unique_id in entries:
+            unindex_package(content_type, unique_id)
+
+            # The entry was removed from disk.
+            if not os.path.isfile(f"{self.folder}/{content_type.value}/{unique_id}/global.yaml"):
+                continue
+
+            try:
+                package = self._read_content_entry(content_type, content_type.value, unique_id)
+            except Exception:
+                log.exception(f"Failed to load entry {content_type.value}/{unique_id}. Skipping.")
+                continue
+
+            self._index_entry(content_type, unique_id, package)
+
+        set_dependency_check(True)
+
+        # Only the versions of the reloaded entries, and the versions that
+        # depend on those entries, can have changed their validity.
+        entries = set(entries)
+        version_dep_check = []
+        for content_type in ContentType:
+            for package in get_indexed_packages(content_type=content_type):
+                changed = (content_type, package["unique_id"]) in entries
+
+                for version in package["versions"]:
+                    if changed or any(
+                        (dependency["content_type"], dependency["unique_id"]) in entries
+                        for dependency in version.get("dependencies", [])
+                    ):
+                        version_dep_check.append(version)
+
+        self._validate_dependencies(version_dep_check)
+
+        log.info("Reloaded %d changed entries", len(entries))
 
     def store_version(self, path, version):
-        data = VersionMinimized().dump(version)
+        data = dump_version_minimized(version)
         data["upload-date"] = date_string(data["upload-date"].replace("+00:00", "Z"))
         upload_date = data["upload-date"].replace("-", "").replace(":", "")
 
@@ -229,3 +461,36 @@ class Index:
             self.files.append(self.store_version(path, version))
 
         self.commit()
+
+
+def _read_content_entry_in_worker(folder, validate, entry):
+    # This runs in a worker process. Not every exception survives pickling,
+    # so return the traceback as text instead of raising it.
+    content_type, unique_id = entry
+
+    try:
+        return Index(folder)._read_content_entry(content_type, content_type.value, unique_id, validate), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+@click_helper.extend
+@click.option(
+    "--index-load-workers",
+    help="Amount of processes to use to read the index from disk; 0 means one per CPU core.",
+    type=click.IntRange(min=0),
+    default=1,
+    show_default=True,
+    metavar="COUNT",
+)
+@click.option(
+    "--index-snapshot-file",
+    help="File to store a snapshot of the loaded index in. On startup, this snapshot is used instead of reading "
+    "all the files, as long as the index did not change since. Reloads always read the files.",
+    type=click.Path(dir_okay=False, file_okay=True),
+)
+def click_index_common_disk(index_load_workers, index_snapshot_file):
+    global _load_workers, _snapshot_file
+
+    _load_workers = index_load_workers
+    _snapshot_file = index_snapshot_file
@@ -95,7 +95,7 @@ class Index(LocalIndex):
 
     def reload(self):
         self._fetch_latest(_github_branch)
-        super().reload()
+        return super().reload()
 
     def push_changes(self):
         super().push_changes()
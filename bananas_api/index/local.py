@@ -1,9 +1,21 @@
 import click
+import contextlib
+import fcntl
 import git
+import logging
+import os
 
 from openttd_helpers import click_helper
 
 from .common_disk import Index as CommonDiskIndex
+from ..helpers.content_storage import build_local_storage
+from ..helpers.enums import ContentType
+
+log = logging.getLogger(__name__)
+
+# Lives in the ".git" folder, so it never shows up as a change in the
+# working tree.
+LOCK_FILENAME = "bananas-api.lock"
 
 _folder = None
 _username = None
@@ -15,6 +27,7 @@ class Index(CommonDiskIndex):
         super().__init__(_folder)
 
         self._git_author = git.Actor(_username, _email)
+        self._loaded_commit = None
 
     def prepare(self):
         try:
@@ -24,6 +37,74 @@ class Index(CommonDiskIndex):
         except git.exc.InvalidGitRepositoryError:
             self._init_repository()
 
+    def get_snapshot_key(self):
+        # Any local modification means the files on disk no longer match
+        # the commit, so there is no valid snapshot possible.
+        if self._git.is_dirty(untracked_files=True):
+            return None
+
+        return self._git.head.commit.hexsha
+
+    def _get_changed_entries(self):
+        # Without a clean working tree, "git diff" between two commits
+        # doesn't tell the whole story.
+        if self._loaded_commit is None or self._git.is_dirty(untracked_files=True):
+            return None
+
+        try:
+            diff = self._git.git.diff("--name-only", "--no-renames", self._loaded_commit, "HEAD")
+        except git.exc.GitCommandError:
+            # For example, when the history was rewritten and the commit is
+            # no longer known.
+            log.exception("Failed to find the changes since the last load")
+            return None
+
+        content_types = {content_type.value: content_type for content_type in ContentType}
+
+        entries = set()
+        for filename in diff.splitlines():
+            path = filename.split("/")
+            if len(path) < 3 or path[0] not in content_types:
+                continue
+
+            entries.add((content_types[path[0]], path[1]))
+
+        return sorted(entries, key=lambda entry: (entry[0].value, entry[1]))
+
+    def load_all(self, validate=False, validate_entries=False):
+        commit = self._git.head.commit.hexsha
+        super().load_all(validate=validate, validate_entries=validate_entries)
+        self._loaded_commit = commit
+
+    def reload_from_disk(self):
+        commit = self._git.head.commit.hexsha
+
+        entries = self._get_changed_entries()
+        if entries is None:
+            return super().reload_from_disk()
+
+        with build_local_storage(copy_current=True) as storage:
+            self.reload_entries(entries)
+
+        self._loaded_commit = commit
+        return storage
+
+    def before_fork(self):
+        # GitPython keeps "git cat-file" processes around to read objects
+        # with; these can't be shared between processes. After this, every
+        # process starts its own when needed.
+        self._git.close()
+
+    @contextlib.contextmanager
+    def lock(self, shared=False):
+        # With multiple workers, the writer changes the working tree (fetch,
+        # store and commit) while readers might be reading from it. This lock
+        # is shared between processes, so readers never see a half-written
+        # working tree. Readers only read, so they can share it among them.
+        with open(os.path.join(self._git.git_dir, LOCK_FILENAME), "a") as fp:
+            fcntl.flock(fp, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+
     def _init_repository(self):
         self._git = git.Repo.init(self.folder)
         # Always make sure there is a commit in the working tree, otherwise
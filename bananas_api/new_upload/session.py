@@ -42,6 +42,7 @@ from ..helpers.content_storage import (
     is_on_blacklist,
 )
 from ..helpers.enums import Status
+from ..helpers.tracing import span
 
 log = logging.getLogger(__name__)
 
@@ -163,6 +164,10 @@ def get_session(user, token):
     return session
 
 
+def get_session_count():
+    return len(_sessions)
+
+
 def get_session_by_token(token):
     if token not in _tokens:
         return None
@@ -182,11 +187,13 @@ def validate_session(session):
     session["errors"] = []
     session["warnings"] = []
 
-    try:
-        data = validate_files(session["files"])
-    except ValidationException as e:
-        session["errors"].append(e.args[0])
-        data = None
+    files = session["files"]
+    with span("validate", session["token"], files=len(files), bytes=sum(f["filesize"] for f in files)):
+        try:
+            data = validate_files(files)
+        except ValidationException as e:
+            session["errors"].append(e.args[0])
+            data = None
 
     for file_info in session["files"]:
         if file_info["errors"]:
@@ -226,6 +233,11 @@ def validate_session(session):
 
 
 def add_file(session, uuid, filename, filesize, internal_filename, announcing=False):
+    with span("add-file", session["token"], filename=filename, bytes=filesize, announcing=announcing):
+        _add_file(session, uuid, filename, filesize, internal_filename, announcing)
+
+
+def _add_file(session, uuid, filename, filesize, internal_filename, announcing):
     new_file = {
         "uuid": uuid,
         "filename": filename,
@@ -250,7 +262,10 @@ def add_file(session, uuid, filename, filesize, internal_filename, announcing=Fa
 
         if filename.lower().endswith(TARBALL_EXTENSIONS):
             try:
-                session["files"].extend(extract_tarball(new_file))
+                with span("extract-tarball", bytes=filesize) as extract_span:
+                    files = extract_tarball(new_file)
+                    extract_span.set("files", len(files))
+                session["files"].extend(files)
             except ArchiveError:
                 new_file["errors"].append("couldn't extract archive file; is it a valid tarball?")
                 session["files"].append(new_file)
@@ -260,7 +275,10 @@ def add_file(session, uuid, filename, filesize, internal_filename, announcing=Fa
             os.unlink(f"{new_file['internal_filename']}.info")
         elif filename.lower().endswith(ZIPFILE_EXTENSIONS):
             try:
-                session["files"].extend(extract_zip(new_file))
+                with span("extract-zip", bytes=filesize) as extract_span:
+                    files = extract_zip(new_file)
+                    extract_span.set("files", len(files))
+                session["files"].extend(files)
             except ArchiveError:
                 new_file["errors"].append("couldn't extract archive file; is it a valid zipfile?")
                 session["files"].append(new_file)
@@ -295,7 +313,8 @@ def update_session(session, data):
             session[key] = value
 
 
-def publish_session(session):
-    create_tarball(session)
-    create_package(session)
-    cleanup_session(session)
+async def publish_session(session):
+    with span("publish", session["token"], files=len(session["files"])):
+        create_tarball(session)
+        await create_package(session)
+        cleanup_session(session)
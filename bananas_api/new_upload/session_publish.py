@@ -30,6 +30,7 @@ from ..helpers.enums import (
     License,
     PackageType,
 )
+from ..helpers.tracing import span
 from ..storage.local import click_storage_local
 from ..storage.s3 import click_storage_s3
 
@@ -137,10 +138,13 @@ def create_tarball(session):
     tempfile_tar = NamedTemporaryFile(dir=".", delete=False, suffix=".tar")
     tar_path = _safe_name(name) + "-" + _safe_name(session["version"])
     try:
-        filesize = _create_tarball(session, tempfile_tar.name, tar_path)
-        _storage_instance.move_to_storage(
-            tempfile_tar.name, session["content_type"], session["unique_id"], session["md5sum"]
-        )
+        with span("create-tarball", files=len(session["files"])) as tarball_span:
+            filesize = _create_tarball(session, tempfile_tar.name, tar_path)
+            tarball_span.set("bytes", filesize)
+        with span("move-to-storage", bytes=filesize):
+            _storage_instance.move_to_storage(
+                tempfile_tar.name, session["content_type"], session["unique_id"], session["md5sum"]
+            )
     except Exception:
         os.unlink(tempfile_tar.name)
         raise
@@ -148,7 +152,7 @@ def create_tarball(session):
     session["filesize"] = filesize
 
 
-def create_package(session):
+async def create_package(session):
     # We convert it to isoformat and back to get ride of the microseconds.
     upload_date = datetime.now(tz=timezone.utc).isoformat(timespec="seconds")
     upload_date = dateutil.parser.isoparse(upload_date)
@@ -212,7 +216,7 @@ def create_package(session):
     package["versions"].append(version)
     index_version(session["content_type"], session["unique_id"], version)
 
-    store_on_disk(session["user"], package)
+    await store_on_disk(session["user"], package)
 
 
 @click_helper.extend
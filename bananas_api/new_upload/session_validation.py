@@ -1,6 +1,10 @@
 from ..helpers.api_schema import Classification
+from ..helpers.content_storage import (
+    get_indexed_version_by_md5sum_partial,
+    has_indexed_version_name,
+)
 from ..helpers.enums import License
-from ..helpers.regions import REGIONS
+from ..helpers.regions import get_regions
 
 
 def validate_is_valid_package(session, data):
@@ -61,23 +65,19 @@ def validate_unique_version(session, package):
     if "version" not in session:
         return
 
-    for version in package["versions"]:
-        if session["version"] == version["version"]:
-            session["errors"].append("There is already an entry with the same version for this package.")
-            break
+    if has_indexed_version_name(package["content_type"], package["unique_id"], session["version"]):
+        session["errors"].append("There is already an entry with the same version for this package.")
 
 
 def validate_unique_md5sum_partial(session, package):
     if "md5sum_partial" not in session:
         return
 
-    for version in package["versions"]:
-        if session["md5sum_partial"] == version["md5sum_partial"]:
-            session["errors"].append(
-                "There is already an entry with the same md5sum-partial for this package;"
-                " this most likely means you are uploading the exact same content."
-            )
-            break
+    if get_indexed_version_by_md5sum_partial(package["content_type"], package["unique_id"], session["md5sum_partial"]):
+        session["errors"].append(
+            "There is already an entry with the same md5sum-partial for this package;"
+            " this most likely means you are uploading the exact same content."
+        )
 
 
 def validate_new_package(session):
@@ -93,8 +93,9 @@ def validate_new_package(session):
 
 def get_region_codes(codes, region):
     codes.add(region)
-    if REGIONS[region]["parent"]:
-        get_region_codes(codes, REGIONS[region]["parent"])
+    parent = get_regions()[region]["parent"]
+    if parent:
+        get_region_codes(codes, parent)
 
 
 def validate_packet_size(session, package):
@@ -122,8 +123,9 @@ def validate_packet_size(session, package):
     codes = set()
     for region in session.get("regions", package.get("regions", [])):
         get_region_codes(codes, region)
+    regions = get_regions()
     for code in codes:
-        size += len(REGIONS[code]["name"]) + 2
+        size += len(regions[code]["name"]) + 2
 
     if size > 1400:
         session["errors"].append("Entry would exceed OpenTTD packet size; trim down on your description.")
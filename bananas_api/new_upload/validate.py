@@ -7,6 +7,7 @@ from ..helpers.enums import (
     ContentType,
     PackageType,
 )
+from ..helpers.tracing import span
 from .classifiers.heightmap import classify_heightmap
 from .classifiers.newgrf import classify_newgrf
 from .classifiers.scenario import classify_scenario
@@ -216,13 +217,17 @@ def validate_files(files):
 
         file_info["errors"] = []
 
-        with open(file_info["internal_filename"], "rb") as fp:
-            try:
-                obj = _read_object(file_info["filename"], fp)
-            except ValidationException as e:
-                file_info["errors"].append(e.args[0])
-                errors = True
-                continue
+        with span("read-file", filename=file_info["filename"], bytes=file_info["filesize"]) as read_span:
+            with open(file_info["internal_filename"], "rb") as fp:
+                try:
+                    obj = _read_object(file_info["filename"], fp)
+                except ValidationException as e:
+                    file_info["errors"].append(e.args[0])
+                    errors = True
+                    continue
+
+            if obj:
+                read_span.set("package-type", obj.package_type.name)
 
         if obj:
             file_info["package_type"] = obj.package_type
@@ -1,4 +1,3 @@
-import boto3
 import click
 import os
 
@@ -13,6 +12,9 @@ class Storage:
         if _bucket_name is None:
             raise Exception("--storage-s3-bucket has to be given if storage is s3")
 
+        # boto3 takes a while to import; only do so when S3 is actually used.
+        import boto3
+
         self._s3 = boto3.client("s3", endpoint_url=_endpoint_url)
 
     def move_to_storage(self, filename, content_type, unique_id, md5sum):
@@ -2,7 +2,6 @@ import click
 import secrets
 
 from aiohttp import web
-from aioauth_client import GithubClient
 from openttd_helpers import click_helper
 
 from .base import User as BaseUser
@@ -58,6 +57,10 @@ class User(BaseUser):
         if not GITHUB_CLIENT_ID or not GITHUB_CLIENT_SECRET:
             raise Exception("GITHUB_CLIENT_ID and GITHUB_CLIENT_SECRET should be set via environment")
 
+        # aioauth_client takes a while to import; only do so when GitHub is
+        # actually used.
+        from aioauth_client import GithubClient
+
         self._github = GithubClient(client_id=GITHUB_CLIENT_ID, client_secret=GITHUB_CLIENT_SECRET)
         self._github.access_token_url = f"{GITHUB_URL}/login/oauth/access_token"
         self._github.base_url = GITHUB_API_URL
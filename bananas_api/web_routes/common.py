@@ -5,6 +5,15 @@ from aiohttp import web
 from openttd_helpers import click_helper
 
 from ..helpers.content_save import reload_index
+from ..helpers.metrics import (
+    format_metrics,
+    get_process_metrics,
+)
+from ..helpers.web_routes import json_response
+from ..helpers.workers import (
+    collect_from_workers,
+    get_worker_name,
+)
 
 log = logging.getLogger(__name__)
 routes = web.RouteTableDef()
@@ -17,6 +26,26 @@ async def healthz_handler(request):
     return web.HTTPOk()
 
 
+@routes.get("/metrics")
+async def metrics(request):
+    processes = [(get_worker_name(), get_process_metrics())]
+
+    # With multiple workers, every worker has metrics of its own.
+    if get_worker_name() is not None:
+        processes.extend(await collect_from_workers(request.app, "/metrics/process"))
+        processes.sort(key=lambda process: process[0])
+
+    text = format_metrics(processes)
+    return web.Response(text=text, content_type="text/plain", headers={"Cache-Control": "no-cache"})
+
+
+@routes.get("/metrics/process")
+async def metrics_process(request):
+    # The metrics of only this process; used to collect the metrics of all
+    # workers.
+    return json_response(get_process_metrics(), headers={"Cache-Control": "no-cache"})
+
+
 @routes.post("/reload")
 async def reload(request):
     if RELOAD_SECRET is None:
@@ -30,6 +59,8 @@ async def reload(request):
     if data["secret"] != RELOAD_SECRET:
         return web.HTTPNotFound()
 
+    # The reload happens in the background; till it is done, the current
+    # index keeps on being served.
     reload_index()
 
     return web.HTTPNoContent()
@@ -10,11 +10,12 @@ from ..helpers.enums import (
     Branch,
     License,
 )
-from ..helpers.regions import REGIONS
+from ..helpers.regions import get_regions
 from ..helpers.user_session import (
     get_user_method,
     get_user_methods,
 )
+from ..helpers.web_routes import json_response
 
 routes = web.RouteTableDef()
 
@@ -56,7 +57,7 @@ async def config_user_audiences(request):
                 }
             )
         )
-    return web.json_response(methods)
+    return json_response(methods)
 
 
 @routes.get("/config/licenses")
@@ -64,7 +65,7 @@ async def config_licenses(request):
     licenses = []
     for license, active in LICENSES.items():
         licenses.append(ConfigLicense().dump({"name": license.value, "deprecated": not active}))
-    return web.json_response(licenses)
+    return json_response(licenses)
 
 
 @routes.get("/config/branches")
@@ -72,15 +73,15 @@ async def config_branches(request):
     branches = []
     for branch, description in BRANCHES.items():
         branches.append(ConfigBranch().dump({"name": branch.value, "description": description}))
-    return web.json_response(branches)
+    return json_response(branches)
 
 
 @routes.get("/config/regions")
 async def config_regions(request):
     regions = []
-    for code, region in sorted(REGIONS.items(), key=lambda x: x[0]):
+    for code, region in sorted(get_regions().items(), key=lambda x: x[0]):
         data = {"code": code, "name": region["name"]}
         if "parent" in region:
             data["parent"] = region["parent"]
         regions.append(ConfigRegion().dump(data))
-    return web.json_response(regions)
+    return json_response(regions)
@@ -1,57 +1,532 @@
+import bisect
+import brotli
+import click
 import copy
+import gzip
+import hashlib
+import itertools
+
+from collections import OrderedDict
 
 from aiohttp import web
+from openttd_helpers import click_helper
 
 from ..helpers.api_schema import (
+    dump_package,
+    dump_version,
     Package,
     Version,
 )
 from ..helpers.content_storage import (
+    get_changes_sequence,
+    get_changes_since,
     get_indexed_package,
     get_indexed_packages,
     get_indexed_version,
+    get_indexed_version_by_md5sum_partial,
+    get_package_last_changed,
+    get_storage_generation,
+    get_storage_last_modified,
+    get_version_dependents,
+    resolve_dependencies,
+    search_indexed_packages,
 )
+from ..helpers.enums import ContentType
+from ..helpers.filter_index import FilterIndex
 from ..helpers.web_routes import (
+    in_body_batch,
     in_header_authorization,
     in_path_content_type,
     in_path_unique_id,
     in_path_upload_date,
+    in_query_after,
+    in_query_cursor,
+    in_query_fields,
+    in_query_filters,
+    in_query_limit,
+    in_query_md5sum_partial,
+    in_query_search,
     in_query_since,
+    json_dumps,
+    json_response,
+    JSONException,
 )
 
 routes = web.RouteTableDef()
 
+CACHE_CONTROL = None
+
+# Responses smaller than this are never compressed; it is not worth it.
+COMPRESS_MIN_SIZE = 1024
+# In order of preference. Compression is only done once per change of the
+# index, so we can afford good (but not the slowest) levels.
+COMPRESSORS = {
+    "br": lambda body: brotli.compress(body, quality=9),
+    "gzip": lambda body: gzip.compress(body, compresslevel=9, mtime=0),
+}
+# Amount of results of a search if no (or a higher) limit is given.
+SEARCH_LIMIT_DEFAULT = 20
+SEARCH_LIMIT_MAX = 100
+# Maximum page size when paginating a content-type; higher limits are lowered.
+PAGE_LIMIT_MAX = 1000
+# Amount of projections (see "fields") of the full list to keep cached.
+PROJECTION_CACHE_SIZE = 32
+# Streamed responses are written in chunks of (at least) this size.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_content_type_cache = {}
+_package_cache = {}
+_projection_cache = OrderedDict()
+_self_cache = {}
+
+
+def _etag(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def _is_not_modified(request, etag):
+    # If-None-Match always uses the weak comparison; so ignore W/.
+    if_none_match = request.if_none_match
+    if not if_none_match:
+        return False
+
+    return any(entry.value in (etag, "*") for entry in if_none_match)
+
+
+def _accepted_encodings(request):
+    encodings = set()
+
+    for entry in request.headers.get("Accept-Encoding", "").split(","):
+        encoding, _, params = entry.partition(";")
+        encoding = encoding.strip().lower()
+        params = params.replace(" ", "")
+
+        # "q=0" means the encoding is explicitly not accepted.
+        if params.startswith("q=") and not any(c not in "0." for c in params[2:]):
+            continue
+
+        encodings.add(encoding)
+
+    return encodings
+
+
+def _compressed_response(request, cache):
+    # Pick the best compression the client accepts; the compressed body is
+    # stored next to the raw body, so it is only compressed once.
+    encoding = None
+    if len(cache["body"]) >= COMPRESS_MIN_SIZE:
+        accepted = _accepted_encodings(request)
+        encoding = next((encoding for encoding in COMPRESSORS if encoding in accepted), None)
+
+    if encoding is None:
+        response = _json_response(request, cache["etag"], lambda: cache["body"], cache["last_modified"])
+    else:
+        if encoding not in cache["compressed"]:
+            cache["compressed"][encoding] = COMPRESSORS[encoding](cache["body"])
+
+        # Every encoding is a different representation, so it needs its own ETag.
+        response = _json_response(
+            request, f"{cache['etag']}-{encoding}", lambda: cache["compressed"][encoding], cache["last_modified"]
+        )
+        response.headers["Content-Encoding"] = encoding
+
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+def _set_cache_headers(response, etag, last_modified, public):
+    response.etag = etag
+    if last_modified:
+        response.last_modified = last_modified
+    if public and CACHE_CONTROL:
+        response.headers["Cache-Control"] = CACHE_CONTROL
+
+
+def _json_response(request, etag, body, last_modified=None, public=True):
+    # "body" is a function, so nothing is serialized when the client already
+    # has the latest version.
+    if _is_not_modified(request, etag):
+        response = web.Response(status=304)
+    else:
+        response = web.Response(body=body(), content_type="application/json")
+
+    _set_cache_headers(response, etag, last_modified, public)
+    return response
+
+
+async def _stream_json_list(request, etag, entries, last_modified=None, public=True):
+    # Write the JSON list entry by entry, so only a single chunk of the
+    # response is in memory at any time, no matter how big the list is.
+    if _is_not_modified(request, etag):
+        return _json_response(request, etag, None, last_modified, public)
+
+    response = web.StreamResponse()
+    response.content_type = "application/json"
+    _set_cache_headers(response, etag, last_modified, public)
+    await response.prepare(request)
+
+    chunk = bytearray(b"[")
+    for index, entry in enumerate(entries):
+        if index:
+            chunk += b","
+        chunk += json_dumps(entry)
+
+        if len(chunk) >= STREAM_CHUNK_SIZE:
+            await response.write(bytes(chunk))
+            chunk.clear()
+
+    chunk += b"]"
+    await response.write(bytes(chunk))
+    await response.write_eof()
+    return response
+
 
 @routes.get("/package/self")
 async def package_from_self(request):
     user = in_header_authorization(request.headers)
+    fields = in_query_fields(request.query.get("fields"), Package)
+
+    # The packages of a user only change if the storage changes; so if the
+    # client already has the ETag of this generation, don't build the body.
+    generation = get_storage_generation()
+    key = (user.full_id, fields.key if fields else None)
+    cache = _self_cache.get(key)
+    if cache and cache["generation"] == generation and _is_not_modified(request, cache["etag"]):
+        return _json_response(request, cache["etag"], None, public=False)
 
     packages = []
     for package in get_indexed_packages(user=user):
-        packages.append(Package().dump(package))
+        packages.append(dump_package(package))
 
-    return web.json_response(packages)
+    if fields:
+        packages = fields.apply(packages)
 
+    body = json_dumps(packages)
+    etag = _etag(body)
+    _self_cache[key] = {"generation": generation, "etag": etag}
+    return _json_response(request, etag, lambda: body, public=False)
 
-@routes.get("/package/{content_type}")
-async def package_by_content_type(request):
-    content_type = in_path_content_type(request.match_info["content_type"])
-    since = in_query_since(request.query.get("since"))
 
+def _get_content_type_cache(content_type):
+    # Serializing all packages of a content-type is expensive, and this is
+    # by far the most requested endpoint. So keep the result till anything
+    # changes in the storage.
+    generation = get_storage_generation()
+
+    cache = _content_type_cache.get(content_type)
+    if cache and cache["generation"] == generation:
+        return cache
+
+    # Sorted on unique-id, which gives a stable order for pagination.
     packages = []
-    for package in get_indexed_packages(content_type=content_type):
-        package_data = Package().dump(package)
+    for package in sorted(get_indexed_packages(content_type=content_type), key=lambda package: package["unique_id"]):
+        package_data = dump_package(package)
         # To heavily reduce bandwidth, only return the versions that are
         # available for new games.
         package_data["versions"] = [
-            version
-            for version in package_data["versions"]
-            if version["availability"] == "new-games" and (not since or version["upload-date"] > since.isoformat())
+            version for version in package_data["versions"] if version["availability"] == "new-games"
         ]
         if len(package_data["versions"]):
             packages.append(package_data)
 
-    return web.json_response(packages)
+    body = json_dumps(packages)
+    cache = {
+        "generation": generation,
+        "last_modified": get_storage_last_modified(),
+        "packages": packages,
+        "unique_ids": [package_data["unique-id"] for package_data in packages],
+        "body": body,
+        "etag": _etag(body),
+        "compressed": {},
+    }
+    _content_type_cache[content_type] = cache
+    return cache
+
+
+def _dump_version(content_type, unique_id, version):
+    # Copy and add two fields to convert VersionMinimized to Version
+    version_data = copy.copy(version)
+    version_data["content_type"] = content_type
+    version_data["unique_id"] = unique_id
+
+    return dump_version(version_data)
+
+
+def _get_projection_cache(content_type, fields):
+    # Projections of the full list are cached like the full list itself; as
+    # there are many possible projections, only the most recently used are
+    # kept.
+    cache = _get_content_type_cache(content_type)
+    key = (content_type, fields.key)
+
+    projection_cache = _projection_cache.get(key)
+    if projection_cache and projection_cache["generation"] == cache["generation"]:
+        _projection_cache.move_to_end(key)
+        return projection_cache
+
+    body = json_dumps(fields.apply(cache["packages"]))
+    projection_cache = {
+        "generation": cache["generation"],
+        "last_modified": cache["last_modified"],
+        "body": body,
+        "etag": _etag(body),
+        "compressed": {},
+    }
+    _projection_cache[key] = projection_cache
+    _projection_cache.move_to_end(key)
+    while len(_projection_cache) > PROJECTION_CACHE_SIZE:
+        _projection_cache.popitem(last=False)
+    return projection_cache
+
+
+def _get_package_cache(key, content_type, unique_id, dump):
+    # Single packages are cached till that package changes; "dump" is only
+    # called if there is no valid entry in the cache.
+    generation, last_modified = get_package_last_changed(content_type, unique_id)
+
+    cache = _package_cache.get(key)
+    if cache and cache["generation"] >= generation:
+        return cache
+
+    data = dump()
+    body = json_dumps(data)
+    cache = {
+        "generation": get_storage_generation(),
+        "last_modified": last_modified,
+        "data": data,
+        "body": body,
+        "etag": _etag(body),
+    }
+    _package_cache[key] = cache
+    return cache
+
+
+def _package_response(request, cache, fields):
+    if not fields:
+        return _json_response(request, cache["etag"], lambda: cache["body"], cache["last_modified"])
+
+    # Projecting a single package is cheap; so it is done on every request.
+    return _json_response(
+        request,
+        f"{cache['etag']}-{fields.key}",
+        lambda: json_dumps(fields.apply(cache["data"])),
+        cache["last_modified"],
+    )
+
+
+def _filter_since(packages, since):
+    for package_data in packages:
+        versions = [version for version in package_data["versions"] if version["upload-date"] > since]
+        if versions:
+            yield {**package_data, "versions": versions}
+
+
+def _batch_entry_data(version_key):
+    content_type, unique_id, md5sum_partial = version_key
+    return {"content-type": content_type.value, "unique-id": unique_id, "md5sum-partial": md5sum_partial}
+
+
+@routes.post("/package/batch")
+async def package_batch(request):
+    fields = in_query_fields(request.query.get("fields"), Version)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        raise JSONException({"message": "request body is not valid JSON"})
+    entries = in_body_batch(data)
+
+    # The result has an entry for every requested entry, in the same order.
+    # This is either the version, or the requested entry with an error.
+    result = []
+    for version_key in entries:
+        content_type, unique_id, md5sum_partial = version_key
+
+        version = get_indexed_version_by_md5sum_partial(content_type, unique_id, md5sum_partial)
+        if version is None:
+            entry_data = _batch_entry_data(version_key)
+            if get_indexed_package(content_type, unique_id) is None:
+                entry_data["error"] = "package not found"
+            else:
+                entry_data["error"] = "version not found"
+            result.append(entry_data)
+            continue
+
+        # Versions are cached just like for the single version lookup; but
+        # on md5sum-partial, as upload-dates are not unique within a package.
+        cache = _get_package_cache(
+            (content_type, unique_id, md5sum_partial),
+            content_type,
+            unique_id,
+            lambda: _dump_version(content_type, unique_id, version),
+        )
+        result.append(fields.apply(cache["data"]) if fields else cache["data"])
+
+    return json_response(result)
+
+
+@routes.post("/package/resolve")
+async def package_resolve(request):
+    fields = in_query_fields(request.query.get("fields"), Version)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        raise JSONException({"message": "request body is not valid JSON"})
+    entries = in_body_batch(data)
+
+    order, missing, cycles = resolve_dependencies(entries)
+
+    # "versions" are the requested versions and everything they depend on,
+    # in the order they should be installed.
+    versions = []
+    for content_type, unique_id, version in order:
+        cache = _get_package_cache(
+            (content_type, unique_id, version["md5sum_partial"]),
+            content_type,
+            unique_id,
+            lambda: _dump_version(content_type, unique_id, version),
+        )
+        versions.append(fields.apply(cache["data"]) if fields else cache["data"])
+
+    return json_response(
+        {
+            "versions": versions,
+            "missing": [_batch_entry_data(version_key) for version_key in missing],
+            "cycles": [[_batch_entry_data(version_key) for version_key in cycle] for cycle in cycles],
+        }
+    )
+
+
+@routes.get("/package/changes")
+async def package_changes(request):
+    after = in_query_after(request.query.get("after"))
+    fields = in_query_fields(request.query.get("fields"), Package)
+
+    # "sequence" is what to pass as "after" on the next call. If "reset" is
+    # set, the changes could not be given (the client is too far behind,
+    # never synced, or synced before the API restarted) and the result is
+    # the full catalogue instead; anything not in it no longer exists.
+    sequence = get_changes_sequence()
+    changes = None if after is None else get_changes_since(*after)
+    reset = changes is None
+    if reset:
+        changes = [
+            (sequence, content_type, package["unique_id"])
+            for content_type in ContentType
+            for package in get_indexed_packages(content_type=content_type)
+        ]
+
+    result = []
+    for change_sequence, content_type, unique_id in changes:
+        entry = {"sequence": change_sequence, "content-type": content_type.value, "unique-id": unique_id}
+
+        package = get_indexed_package(content_type, unique_id)
+        if package is None:
+            # Removed (or blacklisted) packages are reported as tombstone.
+            entry["deleted"] = True
+        else:
+            cache = _get_package_cache(
+                (content_type, unique_id), content_type, unique_id, lambda: dump_package(package)
+            )
+            entry["package"] = fields.apply(cache["data"]) if fields else cache["data"]
+
+        result.append(entry)
+
+    return json_response({"sequence": sequence, "reset": reset, "changes": result})
+
+
+@routes.get("/package/search")
+async def package_search(request):
+    query = in_query_search(request.query.get("q"))
+    limit = min(in_query_limit(request.query.get("limit")) or SEARCH_LIMIT_DEFAULT, SEARCH_LIMIT_MAX)
+    fields = in_query_fields(request.query.get("fields"), Package)
+
+    # Results are ordered on relevance, most relevant first.
+    result = []
+    for package in search_indexed_packages(query, limit):
+        content_type = package["content_type"]
+        unique_id = package["unique_id"]
+
+        cache = _get_package_cache((content_type, unique_id), content_type, unique_id, lambda: dump_package(package))
+        result.append(fields.apply(cache["data"]) if fields else cache["data"])
+
+    return json_response(result)
+
+
+@routes.get("/package/{content_type}")
+async def package_by_content_type(request):
+    content_type = in_path_content_type(request.match_info["content_type"])
+    since = in_query_since(request.query.get("since"))
+    limit = in_query_limit(request.query.get("limit"))
+    if limit is not None:
+        limit = min(limit, PAGE_LIMIT_MAX)
+    cursor = in_query_cursor(request.query.get("cursor"))
+    fields = in_query_fields(request.query.get("fields"), Package)
+
+    if not since and limit is None and cursor is None:
+        if fields:
+            return _compressed_response(request, _get_projection_cache(content_type, fields))
+        return _compressed_response(request, _get_content_type_cache(content_type))
+
+    # The result only depends on the full list and the query.
+    cache = _get_content_type_cache(content_type)
+    etag = cache["etag"]
+    packages = iter(cache["packages"])
+
+    if since:
+        since = since.isoformat()
+        etag += f"-{since}"
+    if cursor:
+        etag += f"-{cursor}"
+        packages = itertools.islice(packages, bisect.bisect_right(cache["unique_ids"], cursor), None)
+    if since:
+        packages = _filter_since(packages, since)
+    if fields:
+        etag += f"-{fields.key}"
+
+    if limit is None:
+        if fields:
+            packages = map(fields.apply, packages)
+
+        # Without a limit the result can be as big as the full list; stream
+        # it instead of building it in memory.
+        return await _stream_json_list(request, etag, packages, cache["last_modified"])
+
+    etag += f"-{limit}"
+    packages = list(itertools.islice(packages, limit + 1))
+
+    def body():
+        if fields:
+            return json_dumps(fields.apply(packages[:limit]))
+        return json_dumps(packages[:limit])
+
+    response = _json_response(request, etag, body, cache["last_modified"])
+    if len(packages) > limit:
+        next_url = request.rel_url.update_query(cursor=packages[limit - 1]["unique-id"])
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return response
+
+
+@routes.get("/package/{content_type}/filter")
+async def package_filter(request):
+    content_type = in_path_content_type(request.match_info["content_type"])
+    filters = in_query_filters(request.query)
+    fields = in_query_fields(request.query.get("fields"), Package)
+
+    # The filter index is built from (and as such lives as long as) the
+    # cached full list; it is only built once it is needed.
+    cache = _get_content_type_cache(content_type)
+    if "filter_index" not in cache:
+        cache["filter_index"] = FilterIndex(cache["packages"])
+    filter_index = cache["filter_index"]
+
+    bitmap = filter_index.query(filters)
+    packages = filter_index.get_packages(bitmap)
+    if fields:
+        packages = fields.apply(packages)
+
+    return json_response({"packages": packages, "facets": filter_index.get_facets(bitmap)})
 
 
 @routes.get("/package/{content_type}/{unique_id}")
@@ -63,8 +538,49 @@ async def package_by_unique_id(request):
     if not package:
         return web.HTTPNotFound()
 
-    package = Package().dump(package)
-    return web.json_response(package)
+    fields = in_query_fields(request.query.get("fields"), Package)
+
+    cache = _get_package_cache((content_type, unique_id), content_type, unique_id, lambda: dump_package(package))
+    return _package_response(request, cache, fields)
+
+
+@routes.get("/package/{content_type}/{unique_id}/dependents")
+async def package_dependents(request):
+    content_type = in_path_content_type(request.match_info["content_type"])
+    unique_id = in_path_unique_id(request.match_info["unique_id"])
+    md5sum_partial = in_query_md5sum_partial(request.query.get("md5sum-partial"))
+
+    package = get_indexed_package(content_type, unique_id)
+    if not package:
+        return web.HTTPNotFound()
+
+    # Either the dependents of a single version, or of all versions.
+    if md5sum_partial:
+        if not get_indexed_version_by_md5sum_partial(content_type, unique_id, md5sum_partial):
+            return web.HTTPNotFound()
+        md5sum_partials = [md5sum_partial]
+    else:
+        md5sum_partials = [version["md5sum_partial"] for version in package["versions"]]
+
+    # Every version depending on this package, and on which version it depends.
+    dependents = []
+    for md5sum_partial in md5sum_partials:
+        for dependent in get_version_dependents(content_type, unique_id, md5sum_partial):
+            dependents.append((dependent, md5sum_partial))
+    dependents.sort(key=lambda entry: (entry[0][0].value, entry[0][1], entry[0][2], entry[1]))
+
+    result = []
+    for (dependent_content_type, dependent_unique_id, dependent_md5sum_partial), md5sum_partial in dependents:
+        result.append(
+            {
+                "content-type": dependent_content_type.value,
+                "unique-id": dependent_unique_id,
+                "md5sum-partial": dependent_md5sum_partial,
+                "depends-on": md5sum_partial,
+            }
+        )
+
+    return json_response(result)
 
 
 @routes.get("/package/{content_type}/{unique_id}/{upload_date}")
@@ -72,15 +588,27 @@ async def package_by_upload_date(request):
     content_type = in_path_content_type(request.match_info["content_type"])
     unique_id = in_path_unique_id(request.match_info["unique_id"])
     upload_date = in_path_upload_date(request.match_info["upload_date"])
+    fields = in_query_fields(request.query.get("fields"), Version)
 
     version = get_indexed_version(content_type, unique_id, upload_date)
     if not version:
         return web.HTTPNotFound()
 
-    # Copy and add two fields to convert VersionMinimized to Version
-    version = copy.copy(version)
-    version["content_type"] = content_type
-    version["unique_id"] = unique_id
+    cache = _get_package_cache(
+        (content_type, unique_id, upload_date),
+        content_type,
+        unique_id,
+        lambda: _dump_version(content_type, unique_id, version),
+    )
+    return _package_response(request, cache, fields)
+
+
+@click_helper.extend
+@click.option(
+    "--discover-cache-control",
+    help="Cache-Control header to send with (public) discover responses; for example 'public, max-age=60'.",
+)
+def click_discover_cache_control(discover_cache_control):
+    global CACHE_CONTROL
 
-    version = Version().dump(version)
-    return web.json_response(version)
+    CACHE_CONTROL = discover_cache_control
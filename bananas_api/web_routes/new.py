@@ -16,6 +16,7 @@ from ..helpers.web_routes import (
     in_header_authorization,
     in_path_file_uuid,
     in_path_upload_token,
+    json_response,
     JSONException,
 )
 from ..new_upload.exceptions import ValidationException
@@ -48,7 +49,7 @@ async def tusd_handler(request):
     hook_name = request.headers.get("Hook-Name")
     if hook_name == "pre-create":
         if "Upload-Metadata" not in headers:
-            return web.json_response({"message": "no filename given in metadata"}, status=400)
+            return json_response({"message": "no filename given in metadata"}, status=400)
 
         # MetaData is stored overly complex: in a single header, comma
         # separated per key-value pair, which is stored space separated. On
@@ -62,10 +63,10 @@ async def tusd_handler(request):
             raise JSONException({"message": "Upload-Metadata header is invalid"})
 
         if not metadata.get("filename"):
-            return web.json_response({"message": "no filename given in metadata"}, status=400)
+            return json_response({"message": "no filename given in metadata"}, status=400)
 
         if not metadata.get("upload-token"):
-            return web.json_response({"message": "no upload-token given in metadata"}, status=400)
+            return json_response({"message": "no upload-token given in metadata"}, status=400)
 
         upload_token = in_path_upload_token(metadata.get("upload-token"))
 
@@ -111,7 +112,7 @@ async def new_start(request):
     token = create_token(user)
 
     payload = UploadNew().dump({"upload_token": str(token)})
-    return web.json_response(payload)
+    return json_response(payload)
 
 
 @routes.get("/new-package/{upload_token}")
@@ -126,7 +127,7 @@ async def new_status(request):
     validate_session(session)
 
     upload_status = UploadStatus().dump(session)
-    return web.json_response(upload_status)
+    return json_response(upload_status)
 
 
 @routes.put("/new-package/{upload_token}")
@@ -141,14 +142,12 @@ async def new_update(request):
     try:
         data = VersionMinimized(dump_only=VersionMinimized.read_only_for_new).load(await request.json())
     except ValidationError as e:
-        return web.json_response(
-            {"message": "request body failed validation", "errors": normalize_message(e)}, status=400
-        )
+        return json_response({"message": "request body failed validation", "errors": normalize_message(e)}, status=400)
 
     try:
         update_session(session, data)
     except ValidationException as e:
-        return web.json_response({"message": "request body failed validation", "errors": e.args[0]}, status=400)
+        return json_response({"message": "request body failed validation", "errors": e.args[0]}, status=400)
 
     return web.HTTPNoContent()
 
@@ -192,9 +191,9 @@ async def new_publish(request):
 
     if session["status"] == Status.ERRORS:
         errors = session["errors"]
-        return web.json_response({"message": "package has validation errors", "errors": errors}, status=400)
+        return json_response({"message": "package has validation errors", "errors": errors}, status=400)
 
-    publish_session(session)
+    await publish_session(session)
 
     upload_status = UploadStatus().dump(session)
-    return web.json_response(upload_status, status=201)
+    return json_response(upload_status, status=201)
@@ -0,0 +1,159 @@
+import asyncio
+import click
+import logging
+import threading
+
+from aiohttp import web
+from openttd_helpers import click_helper
+
+from ..helpers.profiler import (
+    get_biggest_allocations,
+    is_tracemalloc_enabled,
+    sample_stacks,
+    start_tracemalloc,
+)
+from ..helpers.web_routes import (
+    JSONException,
+    json_response,
+)
+from ..helpers.workers import (
+    forward_to_worker,
+    get_worker_name,
+    get_worker_names,
+)
+
+log = logging.getLogger(__name__)
+routes = web.RouteTableDef()
+
+PROFILE_SECRET = None
+PROFILE_DURATION_DEFAULT = 10
+PROFILE_DURATION_MAX = 120
+PROFILE_INTERVAL_DEFAULT = 0.005
+MEMORY_LIMIT_DEFAULT = 25
+MEMORY_LIMIT_MAX = 1000
+MEMORY_GROUP_BY = ("lineno", "filename", "traceback")
+
+_profile_running = False
+
+
+async def _get_payload(request):
+    if PROFILE_SECRET is None:
+        return None
+
+    try:
+        data = await request.json()
+    except ValueError:
+        raise JSONException({"message": "request body is not valid JSON"})
+
+    if not isinstance(data, dict):
+        raise JSONException({"message": "request body should be a JSON object"})
+
+    if "secret" not in data:
+        return None
+
+    if data["secret"] != PROFILE_SECRET:
+        return None
+
+    return data
+
+
+async def _forward_to_worker(request, data):
+    # With multiple workers, a request goes to whichever reader the kernel
+    # picks. "worker" in the payload selects the process to profile instead;
+    # this is also the only way to profile the writer.
+    worker = data.get("worker")
+    if worker is None or worker == get_worker_name():
+        return None
+
+    if worker not in get_worker_names():
+        if not get_worker_names():
+            raise JSONException({"message": "worker can only be given when running with multiple workers"})
+        raise JSONException({"message": f"worker should be one of {', '.join(get_worker_names())}"})
+
+    return await forward_to_worker(request, worker, data)
+
+
+def _in_payload_number(data, key, default, minimum, maximum):
+    value = data.get(key, default)
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or not (minimum <= value <= maximum):
+        raise JSONException({"message": f"{key} should be a number between {minimum} and {maximum}"})
+    return value
+
+
+@routes.post("/profile/cpu")
+async def profile_cpu(request):
+    global _profile_running
+
+    data = await _get_payload(request)
+    if data is None:
+        return web.HTTPNotFound()
+
+    response = await _forward_to_worker(request, data)
+    if response is not None:
+        return response
+
+    duration = _in_payload_number(data, "duration", PROFILE_DURATION_DEFAULT, 0.1, PROFILE_DURATION_MAX)
+    interval = _in_payload_number(data, "interval", PROFILE_INTERVAL_DEFAULT, 0.001, 1)
+    # By default only the thread running the event loop (which is this one)
+    # is of interest.
+    thread_ids = None if data.get("all-threads") else {threading.get_ident()}
+
+    if _profile_running:
+        raise JSONException({"message": "a profile is already running"}, status=409)
+
+    _profile_running = True
+    try:
+        loop = asyncio.get_event_loop()
+        stacks = await loop.run_in_executor(None, sample_stacks, duration, interval, thread_ids)
+    finally:
+        _profile_running = False
+
+    return web.Response(text=stacks, content_type="text/plain")
+
+
+@routes.post("/profile/memory")
+async def profile_memory(request):
+    data = await _get_payload(request)
+    if data is None:
+        return web.HTTPNotFound()
+
+    response = await _forward_to_worker(request, data)
+    if response is not None:
+        return response
+
+    limit = _in_payload_number(data, "limit", MEMORY_LIMIT_DEFAULT, 1, MEMORY_LIMIT_MAX)
+    group_by = data.get("group-by", "lineno")
+    if group_by not in MEMORY_GROUP_BY:
+        raise JSONException({"message": f"group-by should be one of {', '.join(MEMORY_GROUP_BY)}"})
+
+    if not is_tracemalloc_enabled():
+        raise JSONException({"message": "memory allocations are not traced; start with --profile-tracemalloc-frames"})
+
+    loop = asyncio.get_event_loop()
+    allocations = await loop.run_in_executor(None, get_biggest_allocations, int(limit), group_by)
+    return json_response(allocations)
+
+
+@click_helper.extend
+@click.option(
+    "--profile-secret",
+    help="Secret to allow profiling the running process. Always use this via an environment variable! With "
+    'multiple workers, set "worker" in the request to pick the process (like "writer" or "reader 0").',
+)
+@click.option(
+    "--profile-tracemalloc-frames",
+    help="Trace memory allocations, keeping this many frames per allocation. This makes everything slower, and "
+    "uses a lot more memory; only use this when looking into memory usage. (0 = disabled)",
+    default=0,
+    show_default=True,
+    metavar="FRAMES",
+)
+def click_profile(profile_secret, profile_tracemalloc_frames):
+    global PROFILE_SECRET
+
+    PROFILE_SECRET = profile_secret
+
+    # This has to start before the index is loaded, to see the allocations
+    # the index is made of.
+    if profile_tracemalloc_frames:
+        start_tracemalloc(profile_tracemalloc_frames)
@@ -10,12 +10,14 @@ from ..helpers.content_save import queue_store_on_disk
 from ..helpers.content_storage import (
     get_indexed_package,
     get_indexed_version,
+    mark_package_changed,
 )
 from ..helpers.web_routes import (
     in_header_authorization,
     in_path_content_type,
     in_path_unique_id,
     in_path_upload_date,
+    json_response,
 )
 
 routes = web.RouteTableDef()
@@ -40,14 +42,12 @@ async def package_update(request):
     try:
         data = Global(dump_only=Global.read_only).load(await request.json())
     except ValidationError as e:
-        return web.json_response(
-            {"message": "request body failed validation", "errors": normalize_message(e)}, status=400
-        )
+        return json_response({"message": "request body failed validation", "errors": normalize_message(e)}, status=400)
 
     # The only field you are not allowed to make empty (and which you can
     # change), is "version", so do some extra validation there.
     if "name" in data and not len(data["name"].strip()):
-        return web.json_response(
+        return json_response(
             {"message": "request body failed validation", "errors": {"name": ["Cannot be empty"]}}, status=400
         )
 
@@ -63,6 +63,7 @@ async def package_update(request):
         else:
             package[key] = value
 
+    mark_package_changed(package)
     queue_store_on_disk(user, package)
 
     return web.HTTPNoContent()
@@ -92,14 +93,12 @@ async def version_update(request):
     try:
         data = VersionMinimized(dump_only=VersionMinimized.read_only).load(await request.json())
     except ValidationError as e:
-        return web.json_response(
-            {"message": "request body failed validation", "errors": normalize_message(e)}, status=400
-        )
+        return json_response({"message": "request body failed validation", "errors": normalize_message(e)}, status=400)
 
     # The only field you are not allowed to make empty (and which you can
     # change), is "version", so do some extra validation there.
     if "version" in data and not len(data["version"].strip()):
-        return web.json_response(
+        return json_response(
             {"message": "request body failed validation", "errors": {"version": ["Cannot be empty"]}}, status=400
         )
 
@@ -115,6 +114,7 @@ async def version_update(request):
         else:
             version[key] = value
 
+    mark_package_changed(package)
     queue_store_on_disk(user, package)
 
     return web.HTTPNoContent()
@@ -22,6 +22,7 @@ from ..helpers.web_routes import (
     in_post_token_code,
     in_post_token_grant_type,
     in_post_token_redirect_uri,
+    json_response,
     JSONException,
 )
 
@@ -88,7 +89,7 @@ async def oauth_token(request):
         return web.HTTPNotFound()
 
     user_login = UserToken().dump({"access_token": user.bearer_token, "token_type": "Bearer"})
-    return web.json_response(user_login)
+    return json_response(user_login)
 
 
 @routes.get("/user/logout")
@@ -104,4 +105,4 @@ async def profile(request):
     user = in_header_authorization(request.headers)
 
     user_profile = UserProfile().dump({"display_name": user.display_name})
-    return web.json_response(user_profile)
+    return json_response(user_profile)
@@ -0,0 +1,98 @@
+import random
+
+from bananas_api.helpers.api_schema import (
+    Package,
+    set_dependency_check,
+)
+from bananas_api.helpers.enums import (
+    Branch,
+    Climate,
+    ContentType,
+    License,
+    NewGRFSet,
+    Palette,
+    Size,
+)
+
+# A synthetic catalogue, shaped like the real one: a few versions per
+# package, of which only the last is available for new games. It uses every
+# field the schemas have, so anything that (de)serializes it is fully
+# exercised.
+
+
+def _version(rng, content_type, index, new_games):
+    version = {
+        "version": f"{index}.{rng.randrange(10)}",
+        "license": rng.choice(list(License)).value,
+        "upload-date": f"20{10 + index:02d}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}T12:00:00+00:00",
+        "md5sum-partial": f"{rng.getrandbits(32):08x}",
+        "filesize": rng.randrange(1000, 10_000_000),
+        "availability": "new-games" if new_games else "savegames-only",
+    }
+
+    if content_type == ContentType.NEWGRF:
+        version["classification"] = {
+            "set": rng.choice(list(NewGRFSet)).value,
+            "palette": rng.choice(list(Palette)).value,
+            "has-high-res": rng.random() < 0.3,
+            "has-sound-effects": rng.random() < 0.5,
+        }
+    elif content_type in (ContentType.SCENARIO, ContentType.HEIGHTMAP):
+        version["classification"] = {
+            "size": rng.choice(list(Size)).value,
+            "climate": rng.choice(list(Climate)).value,
+        }
+
+    if rng.random() < 0.3:
+        version["compatibility"] = [{"name": rng.choice(list(Branch)).value, "conditions": [">= 13.0"]}]
+    if rng.random() < 0.2:
+        version["description"] = "An updated description."
+
+    return version
+
+
+def generate_catalogue(count=3000, seed=1):
+    # Returns a list of loaded packages, like they are in the index.
+    rng = random.Random(seed)
+
+    # Dependencies point to packages that are not indexed.
+    set_dependency_check(False)
+
+    packages = []
+    for index in range(count):
+        content_type = list(ContentType)[index % len(ContentType)]
+
+        versions = [_version(rng, content_type, i, i == 2) for i in range(3)]
+        if packages and rng.random() < 0.3:
+            dependency = rng.choice(packages)
+            versions[-1]["dependencies"] = [
+                {
+                    "content-type": dependency["content_type"].value,
+                    "unique-id": dependency["unique_id"],
+                    "md5sum-partial": dependency["versions"][-1]["md5sum_partial"],
+                }
+            ]
+
+        package_data = {
+            "content-type": content_type.value,
+            "unique-id": f"{index:08x}",
+            "name": f"Package {index}",
+            "authors": [{"display-name": f"author{index % 97}", "github": str(index % 97)}],
+            "versions": versions,
+        }
+        if rng.random() < 0.7:
+            package_data["description"] = f"Description of package {index}.\nIt has multiple lines."
+        if rng.random() < 0.5:
+            package_data["url"] = f"https://www.example.com/{index}"
+        if rng.random() < 0.3:
+            package_data["tags"] = ["trains", "vehicles"]
+        if rng.random() < 0.2:
+            package_data["regions"] = ["NL", "UN-150"]
+        if rng.random() < 0.05:
+            package_data["archived"] = True
+            package_data["replaced-by"] = {"unique-id": f"{(index + 1):08x}"}
+
+        packages.append(Package().load(package_data))
+
+    set_dependency_check(True)
+    return packages
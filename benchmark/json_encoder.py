@@ -0,0 +1,39 @@
+import timeit
+
+from bananas_api.helpers import web_routes
+from bananas_api.helpers.api_schema import dump_package
+from bananas_api.helpers.enums import ContentType
+
+from .catalogue import generate_catalogue
+
+# Compares the JSON encoders on the biggest response there is: the listing
+# of all the newgrfs, as GET /package/newgrf returns it.
+
+RUNS = 200
+
+
+def main():
+    packages = []
+    for package in generate_catalogue():
+        if package["content_type"] != ContentType.NEWGRF:
+            continue
+
+        package_data = dump_package(package)
+        package_data["versions"] = [
+            version for version in package_data["versions"] if version["availability"] == "new-games"
+        ]
+        packages.append(package_data)
+
+    print(f"Encoding {len(packages)} packages, average of {RUNS} runs:")
+
+    encoders = {"stdlib": web_routes._json_dumps_stdlib}
+    if web_routes.orjson:
+        encoders["orjson"] = web_routes._json_dumps_orjson
+
+    for name, encoder in encoders.items():
+        duration = timeit.timeit(lambda: encoder(packages), number=RUNS) / RUNS
+        print(f"  {name}: {duration * 1000:.2f} ms, {len(encoder(packages))} bytes")
+
+
+if __name__ == "__main__":
+    main()
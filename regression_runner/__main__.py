@@ -17,6 +17,7 @@ from collections.abc import Mapping
 from ctypes.util import find_library
 from tempfile import TemporaryDirectory
 from tusclient.client import TusClient
+from urllib.parse import urlencode
 
 log = verboselogs.VerboseLogger(__name__)
 
@@ -30,6 +31,7 @@ session = None
 python_proc = None
 token = "${TOKEN}"
 current_regression = ""
+changes_sequence = None
 
 
 class RegressionFailure(Exception):
@@ -63,6 +65,50 @@ def validate_keys(step, fields):
             raise DefinitionFailure(f"Found key '{key}' in definition, which was not expected")
 
 
+def query_string(step, keys):
+    query = {key: step[key] for key in keys if key in step}
+    if not query:
+        return ""
+    return "?" + urlencode(query, doseq=True)
+
+
+async def check_error(result, step, what):
+    # Returns True if the step expected an error, and it was the one returned.
+    if "error" not in step:
+        if result.status != 200:
+            raise RegressionFailure(f"Couldn't {what}; status_code={result.status}")
+        return False
+
+    if result.status != 400:
+        raise RegressionFailure(f"Expected error during {what} not triggered: {step['error']}")
+
+    data = await result.json()
+    if data["message"] != step["error"]:
+        raise RegressionFailure(
+            f"Expected error during {what} not triggered: {step['error']}; found: {data['message']}"
+        )
+
+    log.info(f"Found expected error during {what}")
+    return True
+
+
+def match_result(expected, data, path="result"):
+    # Every key in "expected" should have the same value in "data"; lists
+    # should have the same length and match entry by entry.
+    if isinstance(expected, Mapping):
+        if not isinstance(data, Mapping):
+            raise RegressionFailure(f"Expected an object for {path}; found: {data}")
+        for key, value in expected.items():
+            match_result(value, data.get(key), f"{path}.{key}")
+    elif isinstance(expected, list):
+        if not isinstance(data, list) or len(data) != len(expected):
+            raise RegressionFailure(f"Expected {len(expected)} entries for {path}; found: {data}")
+        for index, value in enumerate(expected):
+            match_result(value, data[index], f"{path}[{index}]")
+    elif expected != data:
+        raise RegressionFailure(f"Expected '{expected}' for {path}; found: '{data}'")
+
+
 def match_package_in_list(packages_to_match, packages_to_match_to):
     for package in packages_to_match:
         for check_package in packages_to_match_to:
@@ -92,6 +138,22 @@ def match_package_in_list(packages_to_match, packages_to_match_to):
             raise RegressionFailure(f"Couldn't find package in discover self; package={package}")
 
 
+def match_keys(step, packages):
+    # With "fields" set, only the requested fields should be returned.
+    for package in packages:
+        if sorted(package.keys()) != sorted(step["keys"]):
+            raise RegressionFailure(f"Expected only keys {step['keys']} in package; found: {list(package.keys())}")
+
+        if "version-keys" not in step:
+            continue
+
+        for version in package["versions"]:
+            if sorted(version.keys()) != sorted(step["version-keys"]):
+                raise RegressionFailure(
+                    f"Expected only keys {step['version-keys']} in version; found: {list(version.keys())}"
+                )
+
+
 async def handle_user_login(step):
     validate_keys(step, ["api", "username"])
 
@@ -174,33 +236,178 @@ async def handle_discover_self(step):
 
 
 async def handle_discover_content_type(step):
-    validate_keys(step, ["api", "content-type", "packages"])
+    validate_keys(
+        step,
+        [
+            "api",
+            "content-type",
+            "packages",
+            "limit",
+            "cursor",
+            "fields",
+            "count",
+            "next-cursor",
+            "keys",
+            "version-keys",
+            "error",
+        ],
+    )
+
+    result = await api_call(
+        "GET", f"/package/{step['content-type']}" + query_string(step, ["limit", "cursor", "fields"])
+    )
+    if await check_error(result, step, f"discover {step['content-type']}"):
+        return
 
-    result = await api_call("GET", f"/package/{step['content-type']}")
+    data = await result.json()
 
-    if result.status != 200:
+    if "count" in step and len(data) != step["count"]:
         raise RegressionFailure(
-            f"Couldn't find package in discover {step['content-type']}; status_code={result.status}"
+            f"Expected {step['count']} package(s) in discover {step['content-type']}, found {len(data)}"
         )
 
-    data = await result.json()
-    match_package_in_list(step["packages"], data)
+    if "next-cursor" in step:
+        link = result.headers.get("Link")
+        if step["next-cursor"] is None:
+            if link is not None:
+                raise RegressionFailure(f"Expected no next page in discover {step['content-type']}; found: '{link}'")
+        elif link is None or f"cursor={step['next-cursor']}" not in link:
+            raise RegressionFailure(
+                f"Expected next page with cursor '{step['next-cursor']}' in discover {step['content-type']}; "
+                f"found: '{link}'"
+            )
+
+    if "keys" in step:
+        match_keys(step, data)
+
+    match_package_in_list(step.get("packages", []), data)
     log.info(f"Found matching package(s) dicover {step['content-type']}")
 
 
 async def handle_discover_unique_id(step):
-    validate_keys(step, ["api", "content-type", "unique-id", "packages"])
+    validate_keys(step, ["api", "content-type", "unique-id", "packages", "fields", "keys", "version-keys", "error"])
 
-    result = await api_call("GET", f"/package/{step['content-type']}/{step['unique-id']}")
+    result = await api_call(
+        "GET", f"/package/{step['content-type']}/{step['unique-id']}" + query_string(step, ["fields"])
+    )
+    if await check_error(result, step, f"discover {step['content-type']}/{step['unique-id']}"):
+        return
 
-    if result.status != 200:
-        raise RegressionFailure(
-            f"Couldn't find package in discover {step['content-type']}/{step['unique-id']}; status_code={result.status}"
+    data = await result.json()
+
+    if "keys" in step:
+        match_keys(step, [data])
+
+    match_package_in_list(step.get("packages", []), [data])
+    log.info(f"Found matching package(s) dicover {step['content-type']}/{step['unique-id']}")
+
+
+async def handle_discover_batch(step):
+    validate_keys(step, ["api", "packages", "body", "fields", "result", "error"])
+
+    if "body" in step:
+        result = await api_call("POST", "/package/batch" + query_string(step, ["fields"]), data=step["body"])
+    else:
+        result = await api_call(
+            "POST", "/package/batch" + query_string(step, ["fields"]), json={"packages": step["packages"]}
         )
+    if await check_error(result, step, "discover batch"):
+        return
 
     data = await result.json()
-    match_package_in_list(step["packages"], [data])
-    log.info(f"Found matching package(s) dicover {step['content-type']}/{step['unique-id']}")
+    match_result(step["result"], data)
+    log.info("Found matching result in discover batch")
+
+
+async def handle_discover_resolve(step):
+    validate_keys(step, ["api", "packages", "body", "fields", "result", "error"])
+
+    if "body" in step:
+        result = await api_call("POST", "/package/resolve" + query_string(step, ["fields"]), data=step["body"])
+    else:
+        result = await api_call(
+            "POST", "/package/resolve" + query_string(step, ["fields"]), json={"packages": step["packages"]}
+        )
+    if await check_error(result, step, "discover resolve"):
+        return
+
+    data = await result.json()
+    match_result(step["result"], data)
+    log.info("Found matching result in discover resolve")
+
+
+async def handle_discover_changes(step):
+    global changes_sequence
+
+    validate_keys(step, ["api", "after", "fields", "reset", "changes", "error"])
+
+    # "after: last" continues from the sequence returned by the previous call.
+    query = dict(step)
+    if query.get("after") == "last":
+        query["after"] = changes_sequence
+
+    result = await api_call("GET", "/package/changes" + query_string(query, ["after", "fields"]))
+    if await check_error(result, step, "discover changes"):
+        return
+
+    data = await result.json()
+    changes_sequence = data["sequence"]
+
+    if "reset" in step and data["reset"] != step["reset"]:
+        raise RegressionFailure(f"Expected reset to be {step['reset']} in discover changes; found: {data['reset']}")
+    if "changes" in step:
+        match_result(step["changes"], data["changes"], "changes")
+    log.info("Found matching changes in discover changes")
+
+
+async def handle_discover_search(step):
+    validate_keys(step, ["api", "q", "limit", "fields", "result", "error"])
+
+    result = await api_call("GET", "/package/search" + query_string(step, ["q", "limit", "fields"]))
+    if await check_error(result, step, "discover search"):
+        return
+
+    data = await result.json()
+    match_result(step["result"], data)
+    log.info("Found matching result in discover search")
+
+
+async def handle_discover_filter(step):
+    validate_keys(step, ["api", "content-type", "filters", "fields", "packages", "facets", "error"])
+
+    query = dict(step.get("filters", {}))
+    if "fields" in step:
+        query["fields"] = step["fields"]
+
+    result = await api_call("GET", f"/package/{step['content-type']}/filter" + query_string(query, query))
+    if await check_error(result, step, f"discover {step['content-type']} filter"):
+        return
+
+    data = await result.json()
+    match_result(step["packages"], data["packages"], "packages")
+    if "facets" in step:
+        match_result(step["facets"], data["facets"], "facets")
+    log.info(f"Found matching package(s) in discover {step['content-type']} filter")
+
+
+async def handle_discover_dependents(step):
+    validate_keys(step, ["api", "content-type", "unique-id", "md5sum-partial", "result", "not-found", "error"])
+
+    url = f"/package/{step['content-type']}/{step['unique-id']}/dependents"
+    result = await api_call("GET", url + query_string(step, ["md5sum-partial"]))
+
+    if step.get("not-found"):
+        if result.status != 404:
+            raise RegressionFailure(f"Expected {url} to not be found; status_code={result.status}")
+        log.info(f"Found expected not found for {url}")
+        return
+
+    if await check_error(result, step, f"discover {url}"):
+        return
+
+    data = await result.json()
+    match_result(step["result"], data)
+    log.info(f"Found matching result in discover {url}")
 
 
 async def handle_new_start(step):
@@ -375,6 +582,12 @@ api_mapping = {
     "discover/self": handle_discover_self,
     "discover/content-type": handle_discover_content_type,
     "discover/unique-id": handle_discover_unique_id,
+    "discover/batch": handle_discover_batch,
+    "discover/resolve": handle_discover_resolve,
+    "discover/changes": handle_discover_changes,
+    "discover/search": handle_discover_search,
+    "discover/filter": handle_discover_filter,
+    "discover/dependents": handle_discover_dependents,
     "new-package/start": handle_new_start,
     "new-package/update": handle_new_update,
     "new-package/info": handle_new_info,
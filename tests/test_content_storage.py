@@ -0,0 +1,58 @@
+import datetime
+import unittest
+
+from bananas_api.helpers.content_storage import LocalStorage
+from bananas_api.helpers.enums import ContentType
+
+
+def _dependency(unique_id, md5sum_partial):
+    return {"content_type": ContentType.NEWGRF, "unique_id": unique_id, "md5sum_partial": md5sum_partial}
+
+
+def _version(version, year, dependencies):
+    return {
+        "version": version,
+        "md5sum_partial": "aaaaaaaa",
+        "upload_date": datetime.datetime(year, 1, 1, tzinfo=datetime.timezone.utc),
+        "dependencies": dependencies,
+    }
+
+
+# Two versions of the same package with the same md5sum-partial; neither
+# should hide the other.
+VERSION_1 = _version("v1", 2020, [_dependency("00000001", "11111111")])
+VERSION_2 = _version("v2", 2021, [_dependency("00000002", "22222222")])
+PACKAGE = {
+    "content_type": ContentType.SCENARIO,
+    "unique_id": "00000009",
+    "name": "test",
+    "authors": [],
+    "versions": [VERSION_1, VERSION_2],
+}
+VERSION_KEY = (ContentType.SCENARIO, "00000009", "aaaaaaaa")
+
+
+class TestContentStorage(unittest.TestCase):
+    def setUp(self):
+        self.storage = LocalStorage()
+        self.storage.index_package(PACKAGE)
+
+    def test_same_md5sum_partial(self):
+        version = self.storage.get_version_by_md5sum_partial(*VERSION_KEY)
+        self.assertIs(version, VERSION_2)
+
+        self.assertEqual(
+            self.storage.dependencies[VERSION_KEY],
+            ((ContentType.NEWGRF, "00000001", "11111111"), (ContentType.NEWGRF, "00000002", "22222222")),
+        )
+        self.assertEqual(self.storage.dependents[(ContentType.NEWGRF, "00000001", "11111111")], {VERSION_KEY})
+        self.assertEqual(self.storage.dependents[(ContentType.NEWGRF, "00000002", "22222222")], {VERSION_KEY})
+
+    def test_copy(self):
+        storage = self.storage.copy()
+        storage.unindex_package(ContentType.SCENARIO, "00000009")
+
+        self.assertIsNone(storage.get_version_by_md5sum_partial(*VERSION_KEY))
+        self.assertNotIn((ContentType.NEWGRF, "00000001", "11111111"), storage.dependents)
+        self.assertIs(self.storage.get_version_by_md5sum_partial(*VERSION_KEY), VERSION_2)
+        self.assertIn((ContentType.NEWGRF, "00000001", "11111111"), self.storage.dependents)
@@ -0,0 +1,202 @@
+import datetime
+import enum
+import json
+import unittest
+
+from marshmallow import (
+    fields,
+    post_dump,
+    pre_dump,
+)
+
+from bananas_api.helpers.api_schema import (
+    dump_package,
+    dump_version,
+    dump_version_minimized,
+    OrderedSchema,
+    Package,
+    set_dependency_check,
+    Version,
+    VersionMinimized,
+)
+from bananas_api.helpers.schema_dump import compile_dump
+
+# The precompiled dump functions have to give exactly the same output as
+# marshmallow does; this compares both, for every type of field our schemas
+# use.
+
+PACKAGE = {
+    "content-type": "newgrf",
+    "unique-id": "4e4d4c01",
+    "name": "Test",
+    "description": "Multiple\nlines",
+    "url": "https://www.openttd.org/",
+    "tags": ["trains", "vehicles"],
+    "regions": ["NL", "UN-150"],
+    "archived": True,
+    "replaced-by": {"unique-id": "4e4d4c02"},
+    "authors": [
+        {"display-name": "author", "github": "1", "openttd": None},
+        {"display-name": "other", "developer": "2"},
+    ],
+    "versions": [
+        {
+            "version": "1.0",
+            "license": "GPL v2",
+            "upload-date": "2020-01-01T12:00:00+00:00",
+            "md5sum-partial": "c81c3d77",
+            "filesize": 1234,
+            "availability": "savegames-only",
+            "classification": {"set": "train", "palette": "8bpp", "has-high-res": False, "has-sound-effects": True},
+        },
+        {
+            "version": "2.0",
+            "license": "Custom",
+            "upload-date": "2021-06-30T23:59:59+00:00",
+            "md5sum-partial": "fc03854a",
+            "filesize": 5678,
+            "availability": "new-games",
+            "name": "Test 2",
+            "regions": ["DE"],
+            "dependencies": [{"content-type": "base-sounds", "unique-id": "4e554c4c", "md5sum-partial": "b16a57bf"}],
+            "compatibility": [
+                {"name": "vanilla", "conditions": [">= 13.0"]},
+                {"name": "jgrpp", "conditions": [">= 0.50", "< 0.60"]},
+            ],
+        },
+    ],
+}
+
+MINIMAL_PACKAGE = {
+    "content-type": "ai",
+    "unique-id": "41414141",
+    "name": "Minimal",
+    "replaced-by": None,
+    "authors": [],
+    "versions": [
+        {
+            "version": "1",
+            "license": "GPL v3",
+            "upload-date": "2022-02-02T02:02:02+00:00",
+            "md5sum-partial": "01234567",
+            "filesize": 1,
+            "availability": "new-games",
+        },
+    ],
+}
+
+
+class Color(enum.Enum):
+    RED = "red"
+    BLUE = "blue"
+
+
+class Inner(OrderedSchema):
+    value = fields.Integer()
+
+
+class AllFields(OrderedSchema):
+    string = fields.String()
+    integer = fields.Integer()
+    integer_as_string = fields.Integer(as_string=True)
+    boolean = fields.Boolean()
+    enum_by_value = fields.Enum(Color, by_value=True, data_key="enum-by-value")
+    enum_by_name = fields.Enum(Color)
+    date_time = fields.DateTime(format="iso")
+    date_time_rfc = fields.DateTime(format="rfc")
+    float = fields.Float()
+    nested = fields.Nested(Inner(), allow_none=True)
+    nested_many = fields.List(fields.Nested(Inner))
+    list_of_lists = fields.List(fields.List(fields.String()))
+
+
+class WithPreDump(OrderedSchema):
+    value = fields.Integer()
+
+    @pre_dump
+    def hook(self, data, **kwargs):
+        return data
+
+
+class WithPostDump(OrderedSchema):
+    value = fields.Integer()
+
+    @post_dump
+    def hook(self, data, **kwargs):
+        return data
+
+
+class NestedWithHook(OrderedSchema):
+    nested = fields.Nested(WithPostDump())
+
+
+class TestSchemaDump(unittest.TestCase):
+    def assertSameDump(self, schema_class, dump, data):
+        # Compare as JSON, so the order of the keys matters too.
+        self.assertEqual(json.dumps(dump(data)), json.dumps(schema_class().dump(data)))
+
+    def _load_package(self, package_data):
+        # The dependencies in the test data are not indexed.
+        set_dependency_check(False)
+        try:
+            return Package().load(package_data)
+        finally:
+            set_dependency_check(True)
+
+    def test_package(self):
+        for package_data in (PACKAGE, MINIMAL_PACKAGE):
+            package = self._load_package(package_data)
+            self.assertSameDump(Package, dump_package, package)
+
+            for version in package["versions"]:
+                version_data = {
+                    **version,
+                    "content_type": package["content_type"],
+                    "unique_id": package["unique_id"],
+                }
+                self.assertSameDump(Version, dump_version, version_data)
+                self.assertSameDump(VersionMinimized, dump_version_minimized, version_data)
+
+    def test_missing_fields(self):
+        self.assertSameDump(Package, dump_package, {})
+        self.assertSameDump(VersionMinimized, dump_version_minimized, {"upload_date": None})
+
+    def test_all_fields(self):
+        dump = compile_dump(AllFields)
+
+        data = {
+            "string": "text",
+            "integer": 42,
+            "integer_as_string": 42,
+            "boolean": True,
+            "enum_by_value": Color.RED,
+            "enum_by_name": Color.BLUE,
+            "date_time": datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+            "date_time_rfc": datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+            "float": 1.5,
+            "nested": {"value": 1},
+            "nested_many": [{"value": 1}, {"value": 2}],
+            "list_of_lists": [["a"], ["b", "c"]],
+        }
+        self.assertSameDump(AllFields, dump, data)
+
+        # Values of another type than expected, which marshmallow converts.
+        data = {
+            "string": 1,
+            "integer": "42",
+            "integer_as_string": "42",
+            "boolean": 1,
+            "float": 1,
+            "nested": None,
+            "nested_many": [],
+        }
+        self.assertSameDump(AllFields, dump, data)
+
+        # All values None.
+        self.assertSameDump(AllFields, dump, dict.fromkeys(AllFields().fields, None))
+
+    def test_hooks(self):
+        # Hooks are not supported; they should never silently be ignored.
+        for schema_class in (WithPreDump, WithPostDump, NestedWithHook):
+            with self.assertRaises(NotImplementedError):
+                compile_dump(schema_class)
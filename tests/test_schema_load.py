@@ -0,0 +1,49 @@
+import copy
+import unittest
+
+from marshmallow.exceptions import ValidationError
+
+from bananas_api.helpers.api_schema import (
+    load_package_unvalidated,
+    Package,
+    set_dependency_check,
+)
+
+from .test_schema_dump import (
+    MINIMAL_PACKAGE,
+    PACKAGE,
+)
+
+# The precompiled load function skips validators, but should otherwise give
+# exactly the same result as marshmallow does.
+
+
+class TestSchemaLoad(unittest.TestCase):
+    def setUp(self):
+        # The dependencies in the test data are not indexed.
+        set_dependency_check(False)
+
+    def tearDown(self):
+        set_dependency_check(True)
+
+    def test_package(self):
+        for package_data in (PACKAGE, MINIMAL_PACKAGE):
+            self.assertEqual(load_package_unvalidated(copy.deepcopy(package_data)), Package().load(package_data))
+
+    def test_unknown_keys(self):
+        package_data = copy.deepcopy(PACKAGE)
+        package_data["unknown"] = True
+        with self.assertRaises(ValidationError) as e:
+            load_package_unvalidated(package_data)
+        self.assertEqual(e.exception.messages, {"unknown": ["Unknown field."]})
+
+        package_data = copy.deepcopy(PACKAGE)
+        package_data["versions"][0]["classification"]["unknown"] = True
+        with self.assertRaises(ValidationError):
+            load_package_unvalidated(package_data)
+
+    def test_invalid_types(self):
+        package_data = copy.deepcopy(PACKAGE)
+        package_data["versions"][0]["filesize"] = "not a number"
+        with self.assertRaises(ValidationError):
+            load_package_unvalidated(package_data)